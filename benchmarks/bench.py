@@ -0,0 +1,153 @@
+#!/usr/bin/env python3.7
+
+import argparse
+import contextlib
+import difflib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import libcst as cst
+from libcst.metadata import PositionProvider
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmarks.corpus import generate_corpus
+from src.checker import Checker
+from src.modernizer import Modernizer
+
+PHASES = ("parse", "metadata", "checker", "modernizer", "codegen", "diff")
+
+
+def peak_rss() -> int:
+    # bytes; ru_maxrss is in KiB on Linux but in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_source(source: str, timings: Dict[str, float]) -> None:
+    path = Path("(bench)")
+    t0 = time.perf_counter()
+    module = cst.parse_module(source)
+    t1 = time.perf_counter()
+    wrapper = cst.MetadataWrapper(module)
+    wrapper.resolve(PositionProvider)
+    t2 = time.perf_counter()
+    wrapper.visit(Checker(path))
+    t3 = time.perf_counter()
+    modified_tree = wrapper.visit(Modernizer(path))
+    t4 = time.perf_counter()
+    code = modified_tree.code
+    t5 = time.perf_counter()
+    for _ in difflib.unified_diff(source.splitlines(True), code.splitlines(True)):
+        pass
+    t6 = time.perf_counter()
+    for phase, start, end in zip(
+        PHASES, (t0, t1, t2, t3, t4, t5), (t1, t2, t3, t4, t5, t6)
+    ):
+        timings[phase] += end - start
+
+
+def run(args: argparse.Namespace) -> Dict:
+    sources = list(
+        generate_corpus(
+            args.files, args.statements, args.density, args.depth, args.seed
+        )
+    )
+    lines = sum(source.count("\n") for source in sources)
+    timings: Dict[str, float] = {phase: 0.0 for phase in PHASES}
+    runs: List[float] = []
+    rss_before = peak_rss()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for source in sources:
+                bench_source(source, timings)
+            runs.append(time.perf_counter() - start)
+    best = min(runs)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {
+            "files": args.files,
+            "statements": args.statements,
+            "density": args.density,
+            "depth": args.depth,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "lines": lines,
+        # mean per run, in seconds
+        "phases": {phase: t / args.repeat for phase, t in timings.items()},
+        "total": best,
+        "files_per_sec": args.files / best,
+        "lines_per_sec": lines / best,
+        "peak_rss": peak_rss(),
+        "peak_rss_delta": peak_rss() - rss_before,
+    }
+
+
+def report(result: Dict, baseline: Optional[Dict] = None) -> None:
+    print(
+        f"{result['params']['files']} files, {result['lines']} lines: "
+        f"{result['files_per_sec']:.1f} files/s, {result['lines_per_sec']:.0f} lines/s, "
+        f"peak RSS {result['peak_rss'] / 2 ** 20:.1f} MiB"
+    )
+    for phase, t in result["phases"].items():
+        line = f"  {phase:<12}{t * 1000:10.1f} ms"
+        if baseline and baseline["phases"].get(phase):
+            line += f"  ({t / baseline['phases'][phase]:.2f}x baseline)"
+        print(line)
+    if baseline:
+        print(f"  {'total':<12}{result['total'] / baseline['total']:.2f}x baseline")
+
+
+def main() -> Optional[int]:
+    parser = argparse.ArgumentParser(description="Benchmark Checker and Modernizer.")
+    parser.add_argument("--files", type=int, default=20, help="corpus size.")
+    parser.add_argument(
+        "--statements", type=int, default=200, help="statements per file."
+    )
+    parser.add_argument(
+        "--density",
+        type=float,
+        default=0.2,
+        help="fraction of statements using a construct to modernize.",
+    )
+    parser.add_argument("--depth", type=int, default=2, help="function nesting depth.")
+    parser.add_argument("--seed", type=int, default=0, help="corpus random seed.")
+    parser.add_argument("--repeat", type=int, default=3, help="runs to time.")
+    parser.add_argument("-o", "--output", type=Path, help="write results as JSON.")
+    parser.add_argument(
+        "--compare", type=Path, help="JSON results of a previous run to compare to."
+    )
+    args = parser.parse_args()
+    result = run(args)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    report(result, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2) + "\n")
+    return None
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,90 @@
+import random
+from typing import Iterator, List
+
+# Statement templates for synthetic Python 2 code, by construct. `{i}` is a
+# unique counter, `{v}` a local variable name.
+CONSTRUCTS = {
+    "map": [
+        "{v} = map(lambda x: x * 2, range({i}))",
+        "{v} = filter(None, zip(a, b))",
+        "for x in map(str, {v}s):\n{pad}    total += len(x)",
+    ],
+    "xrange": [
+        "for k in xrange({i}):\n{pad}    total += k",
+        "{v} = raw_input('value {i}: ')",
+    ],
+    "iteritems": [
+        "for k, w in d.iteritems():\n{pad}    total += w",
+        "{v} = sorted(d.iterkeys())",
+        "{v} = d.keys() + d.values()",
+    ],
+    "type_comment": ["{v} = compute({i})  # type: int", "{v} = []  # type: List[str]"],
+    "misc": [
+        "{v} = {i} / 3",
+        "{v} = isinstance(s, unicode)",
+        "self.assertEquals({v}, sys.maxint)",
+    ],
+}
+PLAIN = [
+    "{v} = {i}",
+    "{v} = a + b * {i}",
+    "print({v})",
+    "{v} = [x for x in a if x > {i}]",
+    "{v} = {{'k': {i}}}",
+    "if {v} is None:\n{pad}    {v} = {i}",
+]
+IMPORTS = [
+    "import os",
+    "import sys",
+    "import re",
+    "from collections import OrderedDict",
+    "from typing import Dict, List",
+]
+
+
+def generate_module(
+    rng: random.Random,
+    statements: int = 200,
+    density: float = 0.2,
+    depth: int = 2,
+) -> str:
+    lines: List[str] = rng.sample(IMPORTS, rng.randint(0, len(IMPORTS)))
+    lines.append("")
+    kinds = sorted(CONSTRUCTS)
+    i = 0
+    while i < statements:
+        lines.append("")
+        lines.append(f"def func_{i}(a, b, d, s):")
+        lines.append("    # type: (List[int], List[int], Dict[str, int], str) -> int")
+        lines.append("    total = 0")
+        body: List[str] = []
+        for level in range(1, depth + 1):
+            pad = "    " * level
+            if level > 1:
+                body.append(f"{'    ' * (level - 1)}def inner_{i}_{level}(a, b, d, s):")
+                body.append(f"{pad}total = 0")
+            for _ in range(max(1, statements // (depth * 20))):
+                if rng.random() < density:
+                    template = rng.choice(CONSTRUCTS[rng.choice(kinds)])
+                else:
+                    template = rng.choice(PLAIN)
+                v = f"v{i}"
+                body.append(pad + template.format(i=i, v=v, pad=pad))
+                i += 1
+        for level in range(depth, 1, -1):
+            body.append(f"{'    ' * level}return total")
+        lines += body
+        lines.append("    return total")
+    return "\n".join(lines) + "\n"
+
+
+def generate_corpus(
+    files: int,
+    statements: int = 200,
+    density: float = 0.2,
+    depth: int = 2,
+    seed: int = 0,
+) -> Iterator[str]:
+    rng = random.Random(seed)
+    for _ in range(files):
+        yield generate_module(rng, statements, density, depth)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3.7
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import libcst as cst
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.modernizer import Modernizer
+
+
+def nested_source(depth: int, statements: int = 5) -> str:
+    lines: List[str] = []
+    for level in range(depth):
+        pad = "    " * level
+        lines.append(f"{pad}def f{level}(a,  # type: int")
+        lines.append(f"{pad}        b):")
+        lines.append(f"{pad}    # type: (int, int) -> int")
+        for i in range(statements):
+            lines.append(f"{pad}    v{i} = a + b  # type: int")
+    return "\n".join(lines) + "\n"
+
+
+def time_modernizer(source: str, repeat: int) -> float:
+    wrapper = cst.MetadataWrapper(cst.parse_module(source))
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        wrapper.visit(Modernizer(Path("(bench)")))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> Optional[int]:
+    parser = argparse.ArgumentParser(
+        description="Time the Modernizer on increasingly nested functions."
+    )
+    parser.add_argument(
+        "--depths", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(f"{'depth':>6}{'lines':>8}{'ms':>10}{'µs/line':>10}")
+    for depth in args.depths:
+        source = nested_source(depth)
+        lines = source.count("\n")
+        t = time_modernizer(source, args.repeat)
+        print(f"{depth:6d}{lines:8d}{t * 1000:10.2f}{t * 1e6 / lines:10.1f}")
+    return None
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3.7
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+# Seconds spent importing the entry point, on top of the interpreter's own
+# startup. Importing libcst alone takes longer than this.
+IMPORT_BUDGET = 0.15
+
+# only needed once a file is actually parsed
+HEAVY_MODULES = ("libcst", "difflib", "concurrent.futures.process")
+
+
+def _import_times(code: str) -> Dict[str, float]:
+    # cumulative import time of each top-level import, from -X importtime
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times: Dict[str, float] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not name.startswith("  ") and cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def heavy_imports(module: str) -> List[str]:
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}\n"
+            f"print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])",
+        ],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return proc.stdout.split()
+
+
+def import_time(module: str) -> float:
+    baseline = _import_times("pass")
+    times = _import_times(f"import {module}")
+    return sum(t for name, t in times.items() if name not in baseline)
+
+
+def wall_time(argv: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *argv], cwd=ROOT, stdout=subprocess.DEVNULL, check=True
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> Optional[int]:
+    parser = argparse.ArgumentParser(description="Measure the CLI startup time.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    t = min(import_time("src.main") for _ in range(args.repeat))
+    print(f"import src.main: {t * 1000:.1f} ms (budget {IMPORT_BUDGET * 1000:.0f} ms)")
+    print(f"heavy modules imported: {', '.join(heavy_imports('src.main')) or 'none'}")
+    help_time = wall_time(["src/main.py", "--help"], args.repeat)
+    print(f"src/main.py --help: {help_time * 1000:.1f} ms")
+    if t > IMPORT_BUDGET:
+        return 1
+    return None
+
+
+if __name__ == "__main__":
+    sys.exit(main() or 0)
@@ -0,0 +1,109 @@
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+# Layout: magic, entry count, then a table of (key offset, key length, value
+# offset, value length) sorted by key, then the UTF-8 strings. Lookups bisect
+# the table in the memory-mapped file, so opening an index costs nothing and
+# a lookup only touches a few pages.
+MAGIC = b"CSTANN1\0"
+_HEADER = struct.Struct("<8sI")
+_ENTRY = struct.Struct("<IIII")
+
+
+def _package(directory: Path) -> Tuple[str, ...]:
+    # the dotted name of a directory, up to the first one that is not a package
+    if directory.name and (directory / "__init__.py").is_file():
+        return (*_package(directory.parent), directory.name)
+    return ()
+
+
+def module_name(path: Path) -> str:
+    # the same whatever directory the path is relative to
+    path = path.absolute()
+    parts = _package(path.parent)
+    if path.stem != "__init__":
+        parts = (*parts, path.stem)
+    return ".".join(parts)
+
+
+def qualified_annotations(
+    path: Path, annotations: Mapping[Tuple[str, ...], str]
+) -> Dict[str, str]:
+    prefix = module_name(path)
+    return {
+        ".".join((prefix, *key) if prefix else key): value
+        for key, value in annotations.items()
+    }
+
+
+def write_index(path: Path, annotations: Mapping[str, str]) -> None:
+    items = sorted(
+        (key.encode("utf-8"), value.encode("utf-8"))
+        for key, value in annotations.items()
+    )
+    table = bytearray()
+    blob = bytearray()
+    offset = _HEADER.size + _ENTRY.size * len(items)
+    for key, value in items:
+        table += _ENTRY.pack(offset + len(blob), len(key), 0, 0)
+        blob += key
+        struct.pack_into("<II", table, len(table) - 8, offset + len(blob), len(value))
+        blob += value
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    with os.fdopen(fd, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(items)))
+        f.write(table)
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+class AnnotationIndex:
+    def __init__(self, path: Path):
+        with path.open("rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = _HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not an annotation index")
+
+    def close(self) -> None:
+        self.data.close()
+
+    def __enter__(self) -> "AnnotationIndex":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _entry(self, i: int) -> Tuple[bytes, int, int]:
+        key_offset, key_len, value_offset, value_len = _ENTRY.unpack_from(
+            self.data, _HEADER.size + _ENTRY.size * i
+        )
+        return self.data[key_offset : key_offset + key_len], value_offset, value_len
+
+    def get(self, qualname: str) -> Optional[str]:
+        key = qualname.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            found, value_offset, value_len = self._entry(lo)
+            if found == key:
+                return self.data[value_offset : value_offset + value_len].decode()
+        return None
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        for i in range(self.count):
+            key, value_offset, value_len = self._entry(i)
+            value = self.data[value_offset : value_offset + value_len]
+            yield key.decode(), value.decode()
@@ -0,0 +1,184 @@
+import functools
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+import src
+
+if TYPE_CHECKING:
+    from libcst import Module
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache")
+    return Path(base).expanduser() / "cst-test"
+
+
+@functools.lru_cache(maxsize=None)
+def tool_fingerprint() -> str:
+    # The sources of the tool itself stand in for a version number: any edit
+    # to a checker or transform invalidates the whole cache.
+    h = hashlib.sha256()
+    package_dir = Path(src.__file__).parent
+    for path in sorted(package_dir.glob("*.py")):
+        h.update(path.name.encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def runtime_fingerprint() -> str:
+    # libcst's version (read without importing libcst, which cached results
+    # never need) and the interpreter's: parsing and code generation depend
+    # on them
+    try:
+        from importlib.metadata import version
+    except ImportError:  # Python 3.7
+        from libcst._version import __version__ as libcst_version
+    else:
+        libcst_version = version("libcst")
+    return f"{libcst_version}\0{sys.version}"
+
+
+@functools.lru_cache(maxsize=None)
+def parser_fingerprint() -> str:
+    # parsed modules only depend on the runtime and their encoding
+    from src.snapshot import VERSION
+
+    h = hashlib.sha256(f"{runtime_fingerprint()}\0{VERSION}".encode())
+    return h.hexdigest()
+
+
+class _Store:
+    # files named by key, evicted least recently used first
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / key[:2] / key[2:]
+
+    def _write(self, key: str, data: bytes) -> None:
+        entry = self._entry(key)
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=entry.parent, prefix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, entry)
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        entries: List[Tuple[float, int, Path]] = []
+        total = 0
+        for subdir in self.directory.glob("??"):
+            for entry in subdir.iterdir():
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry))
+                total += st.st_size
+        # least recently used first
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+class ModuleCache(_Store):
+    # Parsed modules by source, whatever the options: runs with different
+    # rules share them (see src/snapshot.py).
+
+    def key(self, source: str) -> str:
+        h = hashlib.sha256(parser_fingerprint().encode())
+        h.update(b"\0" + source.encode("utf-8", "surrogatepass"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional["Module"]:
+        entry = self._entry(key)
+        try:
+            data = entry.read_bytes()
+            os.utime(entry)
+        except OSError:
+            return None
+        from src.snapshot import loads
+
+        try:
+            return loads(data)
+        except Exception:
+            # corrupt, or written for other versions of the node classes
+            return None
+
+    def put(self, key: str, module: "Module") -> None:
+        from src.snapshot import dumps
+
+        try:
+            data = dumps(module)
+        except RecursionError:
+            # too deeply nested for the pickler
+            return
+        self._write(key, data)
+
+
+class ResultCache(_Store):
+    def __init__(
+        self,
+        directory: Path,
+        options: Iterable[str] = (),
+        max_size: int = DEFAULT_MAX_SIZE,
+        module_max_size: int = 0,
+    ):
+        super().__init__(directory, max_size)
+        h = hashlib.sha256(tool_fingerprint().encode())
+        h.update(b"\0" + runtime_fingerprint().encode())
+        for option in options:
+            h.update(b"\0" + option.encode())
+        self.fingerprint = h.hexdigest()
+        # Opt-in: parsed modules are several times larger than their source,
+        # and storing them costs about a third of a parse.
+        self.modules = (
+            ModuleCache(directory / "modules", module_max_size)
+            if module_max_size
+            else None
+        )
+
+    def key(self, path: Path, source: str, extra: str = "") -> str:
+        h = hashlib.sha256(self.fingerprint.encode())
+        # diagnostics and diff headers embed the path
+        h.update(b"\0" + str(path).encode("utf-8", "surrogateescape"))
+        h.update(b"\0" + source.encode("utf-8", "surrogatepass"))
+        if extra:
+            h.update(b"\0" + extra.encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entry(key)
+        try:
+            with entry.open(encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def put(self, key: str, **fields: Any) -> None:
+        self._write(key, json.dumps(fields).encode("utf-8"))
+
+    def evict(self) -> None:
+        super().evict()
+        if self.modules:
+            self.modules.evict()
@@ -0,0 +1,114 @@
+import re
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Files changed since a git revision, with their changed line ranges.
+
+# inclusive (first, last) line numbers, sorted
+LineRanges = List[Tuple[int, int]]
+
+HUNK_RE = re.compile(r"@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+# escapes used by git for paths with unusual characters, besides \NNN octal
+ESCAPE_RE = re.compile(r'\\([0-7]{3}|[abtnvfr"\\])')
+ESCAPES = {
+    "a": b"\a",
+    "b": b"\b",
+    "t": b"\t",
+    "n": b"\n",
+    "v": b"\v",
+    "f": b"\f",
+    "r": b"\r",
+    '"': b'"',
+    "\\": b"\\",
+}
+
+
+def git(*args: str) -> str:
+    proc = subprocess.run(
+        ["git", *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if proc.returncode:
+        raise RuntimeError(f"git {args[0]}: {proc.stderr.strip()}")
+    return proc.stdout
+
+
+def merge_base(ref: str) -> str:
+    # so that changes made on `ref` since the branch point are not included
+    return git("merge-base", ref, "HEAD").strip()
+
+
+def unquote(name: str) -> str:
+    # a path as git shows it in diff headers: C-quoted when it has
+    # non-ASCII or special characters, followed by a tab when it has spaces
+    name = name.rstrip("\t")
+    if not (len(name) >= 2 and name.startswith('"') and name.endswith('"')):
+        return name
+    out = bytearray()
+    pos = 1
+    for mo in ESCAPE_RE.finditer(name, 1, len(name) - 1):
+        out += name[pos : mo.start()].encode("utf-8")
+        escape = mo.group(1)
+        out += ESCAPES[escape] if escape in ESCAPES else bytes([int(escape, 8)])
+        pos = mo.end()
+    out += name[pos:-1].encode("utf-8")
+    return out.decode("utf-8", "surrogateescape")
+
+
+def parse_diff(diff: str) -> Dict[Path, LineRanges]:
+    # `git diff -U0 --no-prefix` output; a pure deletion marks the lines
+    # around it
+    changes: Dict[Path, LineRanges] = {}
+    ranges: Optional[LineRanges] = None
+    for line in diff.splitlines():
+        if line.startswith("+++ "):
+            name = unquote(line[4:])
+            ranges = None if name == "/dev/null" else changes.setdefault(Path(name), [])
+        elif line.startswith("@@") and ranges is not None:
+            mo = HUNK_RE.match(line)
+            if not mo:
+                continue
+            start = int(mo.group(1))
+            count = 1 if mo.group(2) is None else int(mo.group(2))
+            if count:
+                ranges.append((start, start + count - 1))
+            else:
+                ranges.append((max(start, 1), start + 1))
+    return changes
+
+
+def changed_files(ref: str) -> Dict[Path, Optional[LineRanges]]:
+    # Python files changed in the work tree since the merge base of `ref` and
+    # HEAD, relative to the current directory; None for new untracked files
+    diff = git(
+        "diff",
+        "-U0",
+        "--no-color",
+        "--no-ext-diff",
+        "--no-prefix",
+        "--relative",
+        "--diff-filter=AMR",
+        merge_base(ref),
+        "--",
+        "*.py",
+    )
+    changes: Dict[Path, Optional[LineRanges]] = {
+        path: ranges for path, ranges in sorted(parse_diff(diff).items())
+    }
+    untracked = git("ls-files", "-z", "--others", "--exclude-standard", "--", "*.py")
+    for name in sorted(untracked.split("\0")):
+        if name:
+            changes[Path(name)] = None
+    return changes
+
+
+def overlaps(
+    ranges: Optional[Sequence[Tuple[int, int]]], first: int, last: int
+) -> bool:
+    if ranges is None:
+        return True
+    return any(start <= last and first <= end for start, end in ranges)
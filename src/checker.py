@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Sequence, Tuple
 
 from libcst import (
     Attribute,
@@ -7,50 +7,85 @@ from libcst import (
     Call,
     ClassDef,
     FunctionDef,
+    CSTNode,
     ImportAlias,
-    ensure_type,
+    Module,
     matchers as m,
 )
-from libcst.metadata import PositionProvider
+from libcst.metadata import CodeRange, PositionProvider
 
+from src.changes import overlaps
+from src.diagnostics import RULES, Diagnostic
+from src.dispatch import CompiledVisitor
+from src.positions import positions
+from src.rules import disabled_rules, rule
 
-class Checker(m.MatcherDecoratableVisitor):
+
+class Checker(CompiledVisitor):
     METADATA_DEPENDENCIES = (PositionProvider,)
 
     def __init__(
-        self, path: Path, verbose: bool = False, ignored: Optional[List[str]] = None
+        self,
+        path: Path,
+        verbose: bool = False,
+        ignored: Optional[List[str]] = None,
+        lazy_positions: bool = False,
+        lines: Optional[Sequence[Tuple[int, int]]] = None,
+        selected: Optional[List[str]] = None,
     ):
-        super().__init__()
+        super().__init__(disabled_rules(selected, ignored))
         self.path = path
         self.verbose = verbose
-        self.ignored = set(ignored or [])
         self.future_division = False
         self.errors = False
         self.stack: List[str] = []
+        # found diagnostics, in visit order; the caller prints them
+        self.diagnostics: List[Diagnostic] = []
+        # With lazy_positions, the checker can visit a bare module, without
+        # metadata: reported nodes are kept until flush(), which only computes
+        # their positions.
+        self.lazy_positions = lazy_positions
+        self.pending: List[Tuple[CSTNode, str]] = []
+        # only report diagnostics on these line ranges, if given
+        self.lines = lines
+
+    def report(self, node: CSTNode, rule: str) -> None:
+        if self.lazy_positions:
+            self.pending.append((node, rule))
+            return
+        self.add(self.get_metadata(PositionProvider, node), rule)
+
+    def flush(self, module: Module) -> None:
+        ranges = positions(module, [node for node, _ in self.pending])
+        for node, rule in self.pending:
+            self.add(ranges[node], rule)
+        self.pending = []
+
+    def add(self, code_range: CodeRange, rule: str) -> None:
+        if not overlaps(self.lines, code_range.start.line, code_range.end.line):
+            return
+        pos = code_range.start
+        self.diagnostics.append(
+            Diagnostic(str(self.path), pos.line, pos.column, rule, RULES[rule])
+        )
+        self.errors = True
 
+    @rule("division")
     @m.call_if_inside(m.ImportFrom(module=m.Name("__future__")))
     @m.visit(m.ImportAlias(name=m.Name("division")))
     def import_div(self, node: ImportAlias) -> None:
         self.future_division = True
 
+    @rule("division")
     @m.visit(m.BinaryOperation(operator=m.Divide()))
     def check_div(self, node: BinaryOperation) -> None:
-        if "division" in self.ignored:
-            return
         if not self.future_division:
-            pos = self.get_metadata(PositionProvider, node).start
-            print(
-                f"{self.path}:{pos.line}:{pos.column}: division without `from __future__ import division`"
-            )
-            self.errors = True
+            self.report(node, "division")
 
+    @rule("sys.maxint")
     @m.visit(m.Attribute(attr=m.Name("maxint"), value=m.Name("sys")))
     def check_maxint(self, node: Attribute) -> None:
-        if "sys.maxint" in self.ignored:
-            return
-        pos = self.get_metadata(PositionProvider, node).start
-        print(f"{self.path}:{pos.line}:{pos.column}: use of sys.maxint")
-        self.errors = True
+        self.report(node, "sys.maxint")
 
     def visit_ClassDef(self, node: ClassDef) -> None:
         self.stack.append(node.name.value)
@@ -67,15 +102,12 @@ class Checker(m.MatcherDecoratableVisitor):
     def visit_ClassDef_bases(self, node: "ClassDef") -> None:
         return
 
-    @m.visit(
-        m.Call(
-            func=m.Attribute(attr=m.Name("assertEquals") | m.Name("assertItemsEqual"))
-        )
-    )
-    def visit_old_assert(self, node: Call) -> None:
-        name = ensure_type(node.func, Attribute).attr.value
-        if name in self.ignored:
-            return
-        pos = self.get_metadata(PositionProvider, node).start
-        print(f"{self.path}:{pos.line}:{pos.column}: use of {name}")
-        self.errors = True
+    @rule("assertEquals")
+    @m.visit(m.Call(func=m.Attribute(attr=m.Name("assertEquals"))))
+    def check_assert_equals(self, node: Call) -> None:
+        self.report(node, "assertEquals")
+
+    @rule("assertItemsEqual")
+    @m.visit(m.Call(func=m.Attribute(attr=m.Name("assertItemsEqual"))))
+    def check_assert_items_equal(self, node: Call) -> None:
+        self.report(node, "assertItemsEqual")
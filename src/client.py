@@ -0,0 +1,61 @@
+import json
+import os
+import socket
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Client side of the daemon protocol (see src/server.py). It only uses the
+# standard library, so that calling it does not pay for importing libcst.
+#
+# A request is one JSON line: {"cwd", "options", "paths", "sources", "lines"},
+# where "sources" is a list of {"path", "source"} buffers to check instead of
+# the files on disk and "lines" maps paths to the line ranges to limit
+# diagnostics and rewrites to, or {"command": "shutdown"}. The server answers
+# with one JSON line per file, in request order, then {"done": true} (with
+# "error" if the request failed).
+
+
+class DaemonError(Exception):
+    pass
+
+
+def request(socket_path: Path, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(payload).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            for line in f:
+                data = json.loads(line)
+                if data.get("done"):
+                    if "error" in data:
+                        raise DaemonError(data["error"])
+                    return
+                yield data
+    raise DaemonError("connection closed by the server")
+
+
+def check(
+    socket_path: Path,
+    paths: Iterable[Path] = (),
+    sources: Optional[Dict[Path, str]] = None,
+    options: Optional[Dict[str, Any]] = None,
+    lines: Optional[Dict[Path, Any]] = None,
+) -> Iterator[Dict[str, Any]]:
+    return request(
+        socket_path,
+        {
+            "cwd": os.getcwd(),
+            "options": options or {},
+            "paths": [str(path) for path in paths],
+            "sources": [
+                {"path": str(path), "source": source}
+                for path, source in (sources or {}).items()
+            ],
+            "lines": {str(path): ranges for path, ranges in (lines or {}).items()},
+        },
+    )
+
+
+def shutdown(socket_path: Path) -> None:
+    for _ in request(socket_path, {"command": "shutdown"}):
+        pass
@@ -0,0 +1,131 @@
+import json
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, TextIO
+
+from src import rules
+
+# Diagnostics as records, and their text, JSON Lines and SARIF renderings.
+
+# messages of the Checker rules
+RULES = {
+    rule.name: rule.description
+    for rule in rules.RULES.values()
+    if rule.kind == "check"
+}
+# not a Checker rule: reported for files the Modernizer would rewrite
+REWRITE_RULE = "rewrite"
+REWRITE_MESSAGE = "file would be rewritten"
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+class Diagnostic(NamedTuple):
+    path: str
+    line: int
+    column: int
+    rule: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.path}:{self.line}:{self.column}: {self.message}"
+
+
+def format_text(diagnostics: Iterable[Diagnostic]) -> str:
+    return "".join(f"{diagnostic}\n" for diagnostic in diagnostics)
+
+
+class JsonLinesEmitter:
+    # one JSON object per diagnostic, and per rewritten file; one write per file
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+
+    def emit(
+        self,
+        path: str,
+        diagnostics: Iterable[Iterable[Any]],
+        changed: bool = False,
+        diff: Optional[str] = None,
+    ) -> None:
+        records: List[Dict[str, Any]] = [
+            Diagnostic(*diagnostic)._asdict() for diagnostic in diagnostics
+        ]
+        if changed:
+            record = {"path": path, "rule": REWRITE_RULE, "message": REWRITE_MESSAGE}
+            if diff is not None:
+                record["diff"] = diff
+            records.append(record)
+        if records:
+            self.stream.write("".join(json.dumps(r) + "\n" for r in records))
+
+    def close(self) -> None:
+        pass
+
+
+class SarifEmitter:
+    # A single SARIF log, written as results come: nothing but the current
+    # file's results is held in memory.
+
+    def __init__(self, stream: TextIO, tool: str = "cst-test"):
+        self.stream = stream
+        self.count = 0
+        rules = [
+            {"id": rule, "shortDescription": {"text": message}}
+            for rule, message in [*RULES.items(), (REWRITE_RULE, REWRITE_MESSAGE)]
+        ]
+        header = json.dumps(
+            {
+                "version": "2.1.0",
+                "$schema": SARIF_SCHEMA,
+                "runs": [{"tool": {"driver": {"name": tool, "rules": rules}}}],
+            }
+        )
+        # reopen the run object to stream its results
+        self.stream.write(header[: -len("}]}")] + ', "results": [\n')
+
+    def emit(
+        self,
+        path: str,
+        diagnostics: Iterable[Iterable[Any]],
+        changed: bool = False,
+        diff: Optional[str] = None,
+    ) -> None:
+        results = []
+        for diagnostic in diagnostics:
+            d = Diagnostic(*diagnostic)
+            results.append(
+                {
+                    "ruleId": d.rule,
+                    "level": "error",
+                    "message": {"text": d.message},
+                    "locations": [
+                        {
+                            "physicalLocation": {
+                                "artifactLocation": {"uri": d.path},
+                                # SARIF columns are 1-based
+                                "region": {
+                                    "startLine": d.line,
+                                    "startColumn": d.column + 1,
+                                },
+                            }
+                        }
+                    ],
+                }
+            )
+        if changed:
+            results.append(
+                {
+                    "ruleId": REWRITE_RULE,
+                    "level": "warning",
+                    "message": {"text": REWRITE_MESSAGE},
+                    "locations": [
+                        {"physicalLocation": {"artifactLocation": {"uri": path}}}
+                    ],
+                }
+            )
+        if results:
+            separator = ",\n" if self.count else ""
+            self.stream.write(separator + ",\n".join(json.dumps(r) for r in results))
+            self.count += len(results)
+
+    def close(self) -> None:
+        self.stream.write("\n]}]}\n")
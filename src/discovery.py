@@ -0,0 +1,215 @@
+import os
+import re
+from collections import deque
+from pathlib import Path
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
+
+# never worth descending into, whether or not a .gitignore says so
+DEFAULT_EXCLUDES = (
+    ".git",
+    ".hg",
+    ".svn",
+    "__pycache__",
+    ".mypy_cache",
+    ".pytest_cache",
+    ".tox",
+    ".nox",
+    ".venv",
+    "venv",
+    "*.egg-info",
+    "node_modules",
+)
+
+
+class _Rule:
+    def __init__(self, pattern: str):
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        elif pattern.startswith("\\"):
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        self.regex = re.compile(
+            ("" if anchored else r"(?:.*/)?") + _translate(pattern) + r"\Z"
+        )
+
+    def match(self, relpath: str, is_dir: bool) -> bool:
+        return (is_dir or not self.dir_only) and bool(self.regex.match(relpath))
+
+
+def _translate(pattern: str) -> str:
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        if pattern.startswith("**/", i):
+            regex.append(r"(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n:
+            regex.append(r"/.*")
+            i += 3
+        elif pattern[i] == "*":
+            regex.append(r"[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            regex.append(r"[^/]")
+            i += 1
+        elif pattern[i] == "[":
+            j = pattern.find("]", i + 2)
+            if j < 0:
+                regex.append(re.escape(pattern[i]))
+                i += 1
+            else:
+                body = pattern[i + 1 : j]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                regex.append(f"[{body}]")
+                i = j + 1
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(regex)
+
+
+class _Gitignore:
+    def __init__(self, rules: List[_Rule]):
+        self.rules = rules
+        # any of the patterns: most paths are ruled out with a single match
+        self.regex = re.compile(
+            "|".join(f"(?:{rule.regex.pattern})" for rule in rules)
+        )
+
+    def ignored(self, relpath: str, is_dir: bool) -> Optional[bool]:
+        # the last matching rule decides
+        if self.regex.match(relpath):
+            for rule in reversed(self.rules):
+                if rule.match(relpath, is_dir):
+                    return not rule.negate
+        return None
+
+
+def _load_gitignore(directory: str) -> Optional[_Gitignore]:
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if line and not line.startswith("#"):
+            rules.append(_Rule(line))
+    return _Gitignore(rules) if rules else None
+
+
+# A .gitignore file, and the path of the directory being walked relative to
+# the file's directory ("" or ending with a slash): the relative paths of
+# entries are built along the walk instead of computed for each rule.
+_Scope = Tuple[str, _Gitignore]
+
+
+def _parent_scopes(directory: str) -> List[_Scope]:
+    # .gitignore files above the starting directory, up to the work tree root
+    parents: List[str] = []
+    current = os.path.abspath(directory)
+    while True:
+        parent = os.path.dirname(current)
+        if os.path.isdir(os.path.join(current, ".git")) or parent == current:
+            break
+        current = parent
+        parents.append(current)
+    scopes: List[_Scope] = []
+    for parent in reversed(parents):
+        gitignore = _load_gitignore(parent)
+        if gitignore:
+            prefix = os.path.relpath(directory, parent).replace(os.sep, "/")
+            scopes.append((prefix + "/", gitignore))
+    return scopes
+
+
+def _ignored(scopes: List[_Scope], name: str, is_dir: bool) -> bool:
+    # the deepest .gitignore with a matching rule decides
+    for prefix, gitignore in reversed(scopes):
+        ignored = gitignore.ignored(prefix + name, is_dir)
+        if ignored is not None:
+            return ignored
+    return False
+
+
+def walk(
+    root: Path, exclude: Iterable[str] = DEFAULT_EXCLUDES, gitignore: bool = True
+) -> Iterator[Path]:
+    # Breadth-first, sorted within each directory: the order is the former
+    # sort by (depth, path), but files are yielded as soon as they are found.
+    excludes = [_Rule(pattern) for pattern in exclude]
+    root_path = os.path.abspath(root)
+    # symbolic links to directories are followed, but each directory is
+    # walked once, so that a link to a parent does not loop forever
+    try:
+        st = os.stat(root_path)
+    except OSError:
+        return
+    visited = {(st.st_dev, st.st_ino)}
+    queue: Deque[Tuple[str, str, List[_Scope]]] = deque()
+    queue.append(
+        (str(root), root_path, _parent_scopes(root_path) if gitignore else [])
+    )
+    while queue:
+        directory, abs_directory, scopes = queue.popleft()
+        if gitignore:
+            found = _load_gitignore(abs_directory)
+            if found:
+                scopes = scopes + [("", found)]
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                is_file = not is_dir and entry.is_file()
+            except OSError:
+                continue
+            if not is_dir and not entry.name.endswith(".py"):
+                continue
+            if any(rule.match(entry.name, is_dir) for rule in excludes):
+                continue
+            if scopes and _ignored(scopes, entry.name, is_dir):
+                continue
+            if is_dir:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if (st.st_dev, st.st_ino) in visited:
+                    continue
+                visited.add((st.st_dev, st.st_ino))
+                abs_path = os.path.join(abs_directory, entry.name)
+                subscopes = [
+                    (f"{prefix}{entry.name}/", found) for prefix, found in scopes
+                ]
+                queue.append((entry.path, abs_path, subscopes))
+            elif is_file:
+                yield Path(entry.path)
+
+
+def discover(
+    paths: Iterable[Path],
+    exclude: Iterable[str] = DEFAULT_EXCLUDES,
+    gitignore: bool = True,
+) -> Iterator[Path]:
+    exclude = list(exclude)
+    for path in paths:
+        i = next((i for i, p in enumerate(path.parts) if "*" in p), -1)
+        if i >= 0:
+            matches = Path(*path.parts[:i]).glob("/".join(path.parts[i:]))
+            for match in sorted(matches, key=lambda path: (len(path.parts), path)):
+                if match.suffix == ".py" and match.is_file():
+                    yield match
+        elif path.is_dir():
+            yield from walk(path, exclude, gitignore)
+        elif path.suffix == ".py":
+            yield path
@@ -0,0 +1,399 @@
+from typing import (
+    Collection,
+    Dict,
+    FrozenSet,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import libcst as cst
+from libcst import (
+    Attribute,
+    CSTNode,
+    CSTTransformer,
+    CSTVisitor,
+    Call,
+    Name,
+    matchers as m,
+)
+from libcst.matchers._visitors import (
+    CONSTRUCTED_LEAVE_MATCHER_ATTR,
+    CONSTRUCTED_VISIT_MATCHER_ATTR,
+    VISIT_NEGATIVE_MATCHER_ATTR,
+    VISIT_POSITIVE_MATCHER_ATTR,
+)
+
+from src.rules import RULE_ATTR
+
+# Drop-in replacements for MatcherDecoratableVisitor/Transformer, supporting
+# the same decorators. libcst evaluates every @visit/@leave matcher and every
+# call_if_inside/call_if_not_inside matcher against every node. Here the
+# matchers are compiled once per class into tables indexed by node type and
+# by a cheap key (see node_key), so that only the matchers that can match a
+# node are evaluated; guards are tracked as counters of matching ancestors.
+# A matcher used by several handlers for a node type (typically the visit and
+# leave handlers of one rewrite) is evaluated once per node: its outcome is
+# kept from the visit until the node is left.
+# Handlers of disabled rules (see src/rules.py) are left out of the tables.
+
+
+def node_key(node: CSTNode) -> Optional[str]:
+    # the called name of a Call, the attribute of an Attribute, a Name's value
+    t = type(node)
+    if t is Call:
+        func = node.func  # type: ignore
+        if type(func) is Name:
+            return func.value
+        if type(func) is Attribute:
+            return func.attr.value
+        return None
+    if t is Attribute:
+        return node.attr.value  # type: ignore
+    if t is Name:
+        return node.value  # type: ignore
+    return None
+
+
+def _name_keys(matcher: object) -> Optional[FrozenSet[str]]:
+    if isinstance(matcher, m.Name) and isinstance(matcher.value, str):
+        return frozenset((matcher.value,))
+    if isinstance(matcher, m.Attribute):
+        return _name_keys(matcher.attr)
+    if isinstance(matcher, m.OneOf):
+        keys: FrozenSet[str] = frozenset()
+        for option in matcher.options:
+            option_keys = _name_keys(option)
+            if option_keys is None:
+                return None
+            keys |= option_keys
+        return keys
+    return None
+
+
+def matcher_keys(matcher: object) -> Optional[FrozenSet[str]]:
+    # a superset of the node_key values of the nodes the matcher can match,
+    # or None if it can't be told
+    if isinstance(matcher, m.Call):
+        return _name_keys(matcher.func)
+    if isinstance(matcher, (m.Attribute, m.Name)):
+        return _name_keys(matcher)
+    if isinstance(matcher, m.OneOf):
+        keys: FrozenSet[str] = frozenset()
+        for option in matcher.options:
+            option_keys = matcher_keys(option)
+            if option_keys is None:
+                return None
+            keys |= option_keys
+        return keys
+    return None
+
+
+def matcher_types(matcher: object) -> Optional[Tuple[type, ...]]:
+    # the node classes the matcher can match, or None for any
+    if isinstance(matcher, m.OneOf):
+        types: Tuple[type, ...] = ()
+        for option in matcher.options:
+            option_types = matcher_types(option)
+            if option_types is None:
+                return None
+            types += option_types
+        return types
+    node_type = getattr(cst, type(matcher).__name__, None)
+    if isinstance(node_type, type) and issubclass(node_type, CSTNode):
+        return (node_type,)
+    return None
+
+
+class _Matcher(NamedTuple):
+    matcher: m.BaseMatcherNode
+    types: Optional[Tuple[type, ...]]
+    keys: Optional[FrozenSet[str]]
+    # the same for equal matchers of a class
+    index: int
+
+    @classmethod
+    def compile(cls, matcher: m.BaseMatcherNode, index: int) -> "_Matcher":
+        return cls(matcher, matcher_types(matcher), matcher_keys(matcher), index)
+
+    def applies(self, node_type: type) -> bool:
+        return self.types is None or issubclass(node_type, self.types)
+
+
+class _Guards(NamedTuple):
+    positive: Tuple[int, ...]
+    negative: Tuple[int, ...]
+
+
+class _Handler(NamedTuple):
+    name: str
+    matcher: _Matcher
+    guards: _Guards
+
+
+class _TypeRules(NamedTuple):
+    visit: List[_Handler]
+    leave: List[_Handler]
+    guards: List[Tuple[int, _Matcher]]
+    # indexes of the matchers of several of these handlers
+    shared: FrozenSet[int]
+
+
+class _Rules:
+    def __init__(self, cls: type, disabled: FrozenSet[str] = frozenset()):
+        self.disabled = disabled
+        guard_matchers: Dict[m.BaseMatcherNode, int] = {}
+        visit: Dict[m.BaseMatcherNode, List[str]] = {}
+        leave: Dict[m.BaseMatcherNode, List[str]] = {}
+        self.guards: Dict[str, _Guards] = {}
+        # same order as libcst: by name, then grouped by matcher
+        for name in dir(cls):
+            func = getattr(cls, name, None)
+            if not callable(func) or not self.enabled(func):
+                continue
+            guards = [
+                tuple(
+                    guard_matchers.setdefault(matcher, len(guard_matchers))
+                    for matcher in getattr(func, attr, [])
+                )
+                for attr in (VISIT_POSITIVE_MATCHER_ATTR, VISIT_NEGATIVE_MATCHER_ATTR)
+            ]
+            self.guards[name] = _Guards(*guards)
+            for matcher in getattr(func, CONSTRUCTED_VISIT_MATCHER_ATTR, []):
+                visit.setdefault(matcher, []).append(name)
+            for matcher in getattr(func, CONSTRUCTED_LEAVE_MATCHER_ATTR, []):
+                leave.setdefault(matcher, []).append(name)
+        compiled: Dict[m.BaseMatcherNode, _Matcher] = {}
+
+        def compile(matcher: m.BaseMatcherNode) -> _Matcher:
+            found = compiled.get(matcher)
+            if found is None:
+                found = compiled[matcher] = _Matcher.compile(matcher, len(compiled))
+            return found
+
+        self.guard_matchers = [compile(matcher) for matcher in guard_matchers]
+        self.visit = [
+            _Handler(name, compile(matcher), self.guards[name])
+            for matcher, names in visit.items()
+            for name in names
+        ]
+        self.leave = [
+            _Handler(name, compile(matcher), self.guards[name])
+            for matcher, names in reversed(list(leave.items()))
+            for name in names
+        ]
+        self.by_type: Dict[type, _TypeRules] = {}
+        self.concrete_names: Dict[Tuple[str, type, str], Optional[str]] = {}
+        self.cls = cls
+        self.base = CSTTransformer if issubclass(cls, CSTTransformer) else CSTVisitor
+
+    def enabled(self, func: object) -> bool:
+        rules = getattr(func, RULE_ATTR, None)
+        return rules is None or any(r not in self.disabled for r in rules)
+
+    def overridden(self, name: str) -> bool:
+        # the base classes' visit_*/leave_* methods do nothing
+        func = getattr(self.cls, name, None)
+        return (
+            callable(func)
+            and func is not getattr(self.base, name, None)
+            and self.enabled(func)
+        )
+
+    def for_type(self, node_type: type) -> _TypeRules:
+        rules = self.by_type.get(node_type)
+        if rules is None:
+            visit = [h for h in self.visit if h.matcher.applies(node_type)]
+            leave = [h for h in self.leave if h.matcher.applies(node_type)]
+            indexes = [h.matcher.index for h in visit + leave]
+            rules = self.by_type[node_type] = _TypeRules(
+                visit,
+                leave,
+                [
+                    (i, g)
+                    for i, g in enumerate(self.guard_matchers)
+                    if g.applies(node_type)
+                ],
+                frozenset(i for i in indexes if indexes.count(i) > 1),
+            )
+        return rules
+
+    def concrete(
+        self, prefix: str, node_type: type, attribute: str = ""
+    ) -> Optional[str]:
+        # name of the visit_Node / leave_Node_attribute method, if defined
+        key = (prefix, node_type, attribute)
+        try:
+            return self.concrete_names[key]
+        except KeyError:
+            name = f"{prefix}_{node_type.__name__}"
+            if attribute:
+                name += f"_{attribute}"
+            found = name if self.overridden(name) else None
+            self.concrete_names[key] = found
+            return found
+
+
+_rules: Dict[Tuple[type, FrozenSet[str]], _Rules] = {}
+
+
+class _CompiledDispatch:
+    # shared by CompiledVisitor and CompiledTransformer
+
+    def _init_dispatch(self, disabled: Collection[str] = ()) -> None:
+        key = (type(self), frozenset(disabled))
+        rules = _rules.get(key)
+        if rules is None:
+            rules = _rules[key] = _Rules(*key)
+        self._rules = rules
+        # per guard matcher, the number of matching nodes we are inside
+        self._inside = [0] * len(rules.guard_matchers)
+        self._entered: List[Tuple[CSTNode, List[int]]] = []
+        # per node being visited, if any, the outcomes of its shared matchers
+        self._memos: List[Tuple[CSTNode, Dict[int, bool]]] = []
+
+    def handler_names(self) -> List[str]:
+        # every method the dispatch may call, e.g. to instrument them
+        rules = self._rules
+        names = {h.name for h in rules.visit} | {h.name for h in rules.leave}
+        for name in dir(rules.cls):
+            if name.startswith(("visit_", "leave_")) and rules.overridden(name):
+                names.add(name)
+        return sorted(names)
+
+    def _allowed(self, guards: _Guards) -> bool:
+        inside = self._inside
+        for i in guards.positive:
+            if not inside[i]:
+                return False
+        for i in guards.negative:
+            if inside[i]:
+                return False
+        return True
+
+    def _matches(
+        self,
+        node: CSTNode,
+        key: Optional[str],
+        matcher: _Matcher,
+        shared: FrozenSet[int] = frozenset(),
+        memo: Optional[Dict[int, bool]] = None,
+    ) -> bool:
+        if matcher.keys is not None and key not in matcher.keys:
+            return False
+        if memo is None or matcher.index not in shared:
+            return self._evaluate(node, matcher)
+        matched = memo.get(matcher.index)
+        if matched is None:
+            matched = memo[matcher.index] = self._evaluate(node, matcher)
+        return matched
+
+    def _evaluate(self, node: CSTNode, matcher: _Matcher) -> bool:
+        return m.matches(node, matcher.matcher, metadata_resolver=self)  # type: ignore
+
+    def _enter(self, node: CSTNode) -> None:
+        rules = self._rules.for_type(type(node))
+        key = node_key(node)
+        if rules.guards:
+            matched = [i for i, g in rules.guards if self._matches(node, key, g)]
+            if matched:
+                for i in matched:
+                    self._inside[i] += 1
+                self._entered.append((node, matched))
+        memo: Optional[Dict[int, bool]] = {} if rules.shared else None
+        for handler in rules.visit:
+            if self._allowed(handler.guards) and self._matches(
+                node, key, handler.matcher, rules.shared, memo
+            ):
+                getattr(self, handler.name)(node)
+        if memo:
+            self._memos.append((node, memo))
+
+    def _memo(self, node: CSTNode) -> Dict[int, bool]:
+        # the outcomes kept by _enter, dropped as the node is left
+        memos = self._memos
+        if memos and memos[-1][0] is node:
+            return memos.pop()[1]
+        return {}
+
+    def _exit(self, node: CSTNode) -> None:
+        entered = self._entered
+        if entered and entered[-1][0] is node:
+            for i in entered.pop()[1]:
+                self._inside[i] -= 1
+
+    def _visit_concrete(self, node: CSTNode) -> bool:
+        name = self._rules.concrete("visit", type(node))
+        if name and self._allowed(self._rules.guards[name]):
+            return getattr(self, name)(node) is not False
+        return True
+
+    def on_visit_attribute(self, node: CSTNode, attribute: str) -> None:
+        name = self._rules.concrete("visit", type(node), attribute)
+        if name and self._allowed(self._rules.guards[name]):
+            getattr(self, name)(node)
+
+    def on_leave_attribute(self, original_node: CSTNode, attribute: str) -> None:
+        name = self._rules.concrete("leave", type(original_node), attribute)
+        if name and self._allowed(self._rules.guards[name]):
+            getattr(self, name)(original_node)
+
+
+class CompiledVisitor(_CompiledDispatch, CSTVisitor):
+    def __init__(self, disabled: Collection[str] = ()) -> None:
+        CSTVisitor.__init__(self)
+        self._init_dispatch(disabled)
+
+    def on_visit(self, node: CSTNode) -> bool:
+        self._enter(node)
+        return self._visit_concrete(node)
+
+    def on_leave(self, original_node: CSTNode) -> None:
+        name = self._rules.concrete("leave", type(original_node))
+        if name and self._allowed(self._rules.guards[name]):
+            getattr(self, name)(original_node)
+        rules = self._rules.for_type(type(original_node))
+        memo = self._memo(original_node)
+        if rules.leave:
+            key = node_key(original_node)
+            for handler in rules.leave:
+                if self._allowed(handler.guards) and self._matches(
+                    original_node, key, handler.matcher, rules.shared, memo
+                ):
+                    getattr(self, handler.name)(original_node)
+        self._exit(original_node)
+
+
+class CompiledTransformer(_CompiledDispatch, CSTTransformer):
+    def __init__(self, disabled: Collection[str] = ()) -> None:
+        CSTTransformer.__init__(self)
+        self._init_dispatch(disabled)
+
+    def on_visit(self, node: CSTNode) -> bool:
+        self._enter(node)
+        return self._visit_concrete(node)
+
+    def on_leave(
+        self, original_node: CSTNode, updated_node: CSTNode
+    ) -> Union[CSTNode, cst.RemovalSentinel, cst.FlattenSentinel]:
+        retval: Union[CSTNode, cst.RemovalSentinel, cst.FlattenSentinel] = updated_node
+        name = self._rules.concrete("leave", type(original_node))
+        if name and self._allowed(self._rules.guards[name]):
+            retval = getattr(self, name)(original_node, updated_node)
+        rules = self._rules.for_type(type(original_node))
+        memo = self._memo(original_node)
+        if rules.leave:
+            key = node_key(original_node)
+            for handler in rules.leave:
+                if (
+                    isinstance(retval, CSTNode)
+                    and self._allowed(handler.guards)
+                    and self._matches(
+                        original_node, key, handler.matcher, rules.shared, memo
+                    )
+                ):
+                    retval = getattr(self, handler.name)(original_node, retval)
+        self._exit(original_node)
+        return retval
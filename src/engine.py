@@ -0,0 +1,93 @@
+import io
+import sys
+from contextlib import ExitStack, contextmanager
+from typing import Iterator, List, Optional, Sequence, TextIO, Union
+
+from libcst import (
+    CSTNode,
+    CSTTransformer,
+    CSTVisitor,
+    MetadataWrapper,
+    RemovalSentinel,
+    MaybeSentinel,
+    FlattenSentinel,
+)
+
+LeaveResult = Union[CSTNode, RemovalSentinel, MaybeSentinel, FlattenSentinel]
+
+
+# Runs several read-only visitors and one transformer in a single traversal.
+# Each visitor behaves as if it walked the tree on its own: one that returns
+# False from on_visit is not called for that node's children, and what it
+# prints is buffered separately so flush() writes the outputs in visitor order,
+# as consecutive passes would.
+class Engine(CSTTransformer):
+    def __init__(self, visitors: Sequence[CSTVisitor], transformer: CSTTransformer):
+        super().__init__()
+        self.visitors: List[Union[CSTVisitor, CSTTransformer]] = [
+            *visitors,
+            transformer,
+        ]
+        self.outputs: List[TextIO] = [io.StringIO() for _ in self.visitors]
+        # per visitor, the node whose children it chose not to visit
+        self.skipped: List[Optional[CSTNode]] = [None for _ in self.visitors]
+
+    @contextmanager
+    def resolve(self, wrapper: MetadataWrapper) -> Iterator[None]:
+        # The wrapper caches computed providers, so metadata shared by several
+        # visitors is only resolved once.
+        with ExitStack() as stack:
+            for visitor in self.visitors:
+                stack.enter_context(visitor.resolve(wrapper))
+            yield
+
+    def flush(self, count: Optional[int] = None) -> None:
+        for output in self.outputs[:count]:
+            sys.stdout.write(output.getvalue())
+
+    def on_visit(self, node: CSTNode) -> bool:
+        stdout = sys.stdout
+        try:
+            for i, visitor in enumerate(self.visitors):
+                if self.skipped[i] is None:
+                    sys.stdout = self.outputs[i]
+                    if not visitor.on_visit(node):
+                        self.skipped[i] = node
+        finally:
+            sys.stdout = stdout
+        return any(skipped is None for skipped in self.skipped)
+
+    def on_leave(self, original_node: CSTNode, updated_node: CSTNode) -> LeaveResult:
+        stdout = sys.stdout
+        try:
+            result: LeaveResult = updated_node
+            last = len(self.visitors) - 1
+            for i, visitor in enumerate(self.visitors):
+                skipped = self.skipped[i]
+                if skipped is not None and skipped is not original_node:
+                    continue
+                self.skipped[i] = None
+                sys.stdout = self.outputs[i]
+                if i == last:
+                    result = visitor.on_leave(original_node, updated_node)
+                else:
+                    visitor.on_leave(original_node)
+            return result
+        finally:
+            sys.stdout = stdout
+
+    def on_visit_attribute(self, node: CSTNode, attribute: str) -> None:
+        self._dispatch_attribute("on_visit_attribute", node, attribute)
+
+    def on_leave_attribute(self, original_node: CSTNode, attribute: str) -> None:
+        self._dispatch_attribute("on_leave_attribute", original_node, attribute)
+
+    def _dispatch_attribute(self, method: str, node: CSTNode, attribute: str) -> None:
+        stdout = sys.stdout
+        try:
+            for i, visitor in enumerate(self.visitors):
+                if self.skipped[i] is None:
+                    sys.stdout = self.outputs[i]
+                    getattr(visitor, method)(node, attribute)
+        finally:
+            sys.stdout = stdout
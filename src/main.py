@@ -1,36 +1,142 @@
 #!/usr/bin/env python3.7
 
 import argparse
-import difflib
+import contextlib
+import functools
 import os
 import sys
+from collections import Counter, deque
 from pathlib import Path
-from typing import Iterable, List, Optional
-
-import libcst as cst
+from itertools import chain, islice
+from typing import TYPE_CHECKING, Deque, Dict, Iterable, Iterator, List, Optional
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from src.checker import Checker
-from src.modernizer import Modernizer
+from src.annotations import write_index
+from src.cache import DEFAULT_MAX_SIZE, ResultCache, default_cache_dir
+from src.changes import LineRanges, changed_files
+from src.diagnostics import JsonLinesEmitter, SarifEmitter
+from src.discovery import DEFAULT_EXCLUDES, discover
+from src.pipeline import OutputStream, prefetch
+from src.profiler import Profile
+from src.rules import RULES, unknown_rules
+from src.runner import FileResult, Options, process_file, process_file_in
+from src.writer import Writer
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, Future
+
+STATUSES = ("parsed", "cached", "skipped", "oversized")
+EMITTERS = {"jsonl": JsonLinesEmitter, "sarif": SarifEmitter}
+
+
+def run_serial(
+    paths: Iterable[Path],
+    options: Options,
+    cache: Optional[ResultCache] = None,
+    jobs: int = 1,
+    changes: Optional[Dict[Path, Optional[LineRanges]]] = None,
+    depth: int = 8,
+) -> Iterator[FileResult]:
+    # the next `depth` files are read while the current one is processed
+    if depth < 1:
+        for path in paths:
+            lines = changes.get(path) if changes else None
+            yield process_file(path, options, cache, sys.stdout, None, lines)
+        return
+    for path, read in prefetch(paths, depth):
+        lines = changes.get(path) if changes else None
+        source, encoding = read.result()
+        yield process_file(path, options, cache, sys.stdout, source, lines, encoding)
+
+
+def run_parallel(
+    paths: Iterable[Path],
+    options: Options,
+    cache: Optional[ResultCache] = None,
+    jobs: Optional[int] = None,
+    changes: Optional[Dict[Path, Optional[LineRanges]]] = None,
+) -> Iterator[FileResult]:
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from run_in_pool(
+            executor,
+            paths,
+            options,
+            cache,
+            (jobs or os.cpu_count() or 1) * 4,
+            changes=changes,
+        )
+
+
+def run_remote(
+    socket_path: Path,
+    paths: Iterable[Path],
+    options: Options,
+    changes: Optional[Dict[Path, Optional[LineRanges]]] = None,
+) -> Iterator[FileResult]:
+    # the daemon (see src/server.py) uses its own cache and worker pool
+    from src import client
 
+    for data in client.check(
+        socket_path, paths, options=options._asdict(), lines=changes
+    ):
+        data["path"] = Path(data["path"])
+        yield FileResult(**data)
 
-def expand_paths(paths: List[Path]) -> Iterable[Path]:
-    expanded_paths = []
-    for path in paths:
-        i = next((i for i, p in enumerate(path.parts) if "*" in p), -1)
-        if i >= 0:
-            expanded_paths += Path(*path.parts[:i]).glob("/".join(path.parts[i:]))
-        elif path.is_dir():
-            expanded_paths += path.glob("*.py")
-        else:
-            expanded_paths.append(path)
-    return sorted(expanded_paths, key=lambda path: (len(path.parts), path))
+
+def run_in_pool(
+    executor: "Executor",
+    paths: Iterable[Path],
+    options: Options,
+    cache: Optional[ResultCache] = None,
+    window: int = 16,
+    sources: Optional[Dict[Path, str]] = None,
+    cwd: Optional[str] = None,
+    changes: Optional[Dict[Path, Optional[LineRanges]]] = None,
+) -> Iterator[FileResult]:
+    # Paths are consumed lazily, keeping a bounded number of files in flight,
+    # so that results come out while the paths are still being discovered.
+    pending: "Deque[Future]" = deque()
+    failed: List[FileResult] = []
+
+    def on_done(future: "Future") -> None:
+        if future.cancelled() or future.exception() or not future.result().errors:
+            return
+        failed.append(future.result())
+        for f in tuple(pending):
+            f.cancel()
+
+    path_iter = iter(paths)
+    while True:
+        while len(pending) < window and not failed:
+            path = next(path_iter, None)
+            if path is None:
+                break
+            source = sources.get(path) if sources else None
+            lines = changes.get(path) if changes else None
+            args = (path, options, cache, None, source, lines)
+            if cwd:
+                future = executor.submit(process_file_in, cwd, *args)
+            else:
+                future = executor.submit(process_file, *args)
+            pending.append(future)
+            if options.exitfirst:
+                future.add_done_callback(on_done)
+        if not pending:
+            return
+        future = pending.popleft()
+        if future.cancelled():
+            # a later file failed first: report it, then stop.
+            yield failed[0]
+            return
+        yield future.result()
 
 
 def main() -> Optional[int]:
     parser = argparse.ArgumentParser(description="Test things.")
-    parser.add_argument("file", nargs="+")
+    parser.add_argument("file", nargs="*")
     parser.add_argument("-v", "--verbose", action="store_true", help="verbose output.")
     parser.add_argument("-q", "--quiet", action="store_true", help="no output.")
     parser.add_argument(
@@ -39,41 +145,304 @@ def main() -> Optional[int]:
         action="store_true",
         help="exit instantly on first error or failed test.",
     )
-    parser.add_argument("--ignore", nargs="*", help="errors to ignore.")
+    parser.add_argument(
+        "--select", nargs="*", metavar="RULE", help="only run these rules."
+    )
+    parser.add_argument(
+        "--ignore", nargs="*", metavar="RULE", help="rules not to run."
+    )
+    parser.add_argument(
+        "--list-rules", action="store_true", help="list the rules and exit."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs).",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=8,
+        metavar="N",
+        help="without worker processes, read up to N files ahead "
+        "(default: %(default)s).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not use the result and parsed module caches.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=default_cache_dir(),
+        help="cache directory (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+        help="maximum size in MiB of the result cache (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--module-cache-size",
+        type=int,
+        default=0,
+        metavar="MIB",
+        help="also cache parsed modules, for runs with other options, up to MIB "
+        "(pickled modules take several times the size of their source; "
+        "default: no module cache).",
+    )
+    parser.add_argument(
+        "--no-prefilter",
+        action="store_true",
+        help="parse every file, even those a token scan shows cannot match.",
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="print file counts on stderr."
+    )
+    parser.add_argument(
+        "--format",
+        choices=("text", *EMITTERS),
+        default="text",
+        help="output diagnostics and files to rewrite as text, JSON Lines or "
+        "SARIF; other output then goes to stderr (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--exclude",
+        nargs="*",
+        default=[],
+        help="file or directory name patterns to skip when walking directories.",
+    )
+    parser.add_argument(
+        "--no-gitignore",
+        action="store_true",
+        help="also walk files and directories ignored by .gitignore files.",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "-w", "--write", action="store_true", help="rewrite files in place."
+    )
+    mode.add_argument(
+        "--check",
+        action="store_true",
+        help="exit with an error if any file would be rewritten.",
+    )
+    mode.add_argument(
+        "--check-only",
+        action="store_true",
+        help="only report diagnostics, without looking for rewrites.",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        type=Path,
+        const=Path("profile.json"),
+        help="time each file, phase and handler; print a summary on stderr and "
+        "write it with a Chrome trace to PROFILE (default: %(const)s).",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=10,
+        help="number of slowest files to report (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--changed-since",
+        metavar="REF",
+        help="only check the Python files changed since the merge base of REF "
+        "and HEAD, including uncommitted and untracked ones, within the given "
+        "files or directories if any.",
+    )
+    parser.add_argument(
+        "--changed-lines",
+        action="store_true",
+        help="with --changed-since, only report diagnostics and make rewrites "
+        "on the changed lines.",
+    )
+    parser.add_argument(
+        "--annotation-index",
+        type=Path,
+        help="write the type comments of all files to this index.",
+    )
+    parser.add_argument(
+        "--max-file-size",
+        type=int,
+        default=0,
+        metavar="KIB",
+        help="size in KiB above which files get the --oversized treatment "
+        "(default: no limit).",
+    )
+    parser.add_argument(
+        "--oversized",
+        choices=("check", "warn", "skip"),
+        default="check",
+        help="for files larger than --max-file-size: only report diagnostics, "
+        "without rewriting (check), skip them with a message (warn) or silently "
+        "(skip) (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--serve",
+        type=Path,
+        metavar="SOCKET",
+        help="run as a daemon with warm worker processes, listening on SOCKET.",
+    )
+    parser.add_argument(
+        "--connect",
+        type=Path,
+        metavar="SOCKET",
+        help="have the daemon listening on SOCKET check the files.",
+    )
     args = parser.parse_args()
-    paths = expand_paths([Path(name).expanduser() for name in args.file])
-    errors = False
-    for path in paths:
-        if path.is_dir() or path.suffix != ".py":
-            continue
-        if args.verbose:
-            print(f"Checking {path}")
-        py_source = path.read_text()
-        module = cst.parse_module(py_source)
-        wrapper = cst.MetadataWrapper(module)
-        checker = Checker(path, args.verbose, args.ignore)
-        wrapper.visit(checker)
-        if checker.errors:
-            if args.exitfirst:
-                return 1
-            errors = True
-        modernizer = Modernizer(path, args.verbose, args.ignore)
-        modified_tree = wrapper.visit(modernizer)
-        if modernizer.errors:
-            if args.exitfirst:
-                return 1
-            errors = True
-        if not args.quiet:
-            diff = "".join(
-                difflib.unified_diff(
-                    py_source.splitlines(True),
-                    modified_tree.code.splitlines(True),
-                    fromfile=f"a{path}",
-                    tofile=f"b{path}",
+    if args.serve:
+        from src.client import DaemonError
+        from src.server import serve
+
+        try:
+            serve(
+                args.serve,
+                args.jobs,
+                None if args.no_cache else args.cache_dir.expanduser(),
+                args.cache_size * 1024 * 1024,
+                args.module_cache_size * 1024 * 1024,
+            )
+        except DaemonError as e:
+            print(f"{parser.prog}: error: {e}", file=sys.stderr)
+            return 1
+        return None
+    if args.list_rules:
+        for r in RULES.values():
+            print(f"{r.name:<18} {r.kind:<8} {r.description}")
+        return None
+    unknown = unknown_rules(chain(args.select or [], args.ignore or []))
+    if unknown:
+        parser.error(f"unknown rules: {', '.join(sorted(unknown))}")
+    if args.changed_lines and not args.changed_since:
+        parser.error("--changed-lines needs --changed-since")
+    if not args.file and not args.changed_since:
+        parser.error("the following arguments are required: file")
+    if args.check_only and args.annotation_index:
+        parser.error("--annotation-index needs the rewriting pass, not --check-only")
+    options = Options(
+        args.verbose,
+        args.quiet,
+        args.exitfirst,
+        args.ignore,
+        # type comments are needed from every file
+        not args.no_prefilter and not args.annotation_index,
+        args.write,
+        bool(args.profile),
+        args.max_file_size * 1024,
+        args.oversized,
+        args.check_only,
+        args.format != "text",
+        args.select,
+        bool(args.annotation_index),
+    )
+    cache = None
+    if not args.no_cache and not args.connect:
+        cache = ResultCache(
+            args.cache_dir.expanduser(),
+            options.fingerprint(),
+            args.cache_size * 1024 * 1024,
+            args.module_cache_size * 1024 * 1024,
+        )
+    changes = None
+    if args.changed_since:
+        try:
+            changed = changed_files(args.changed_since)
+        except RuntimeError as e:
+            parser.error(str(e))
+        if args.file:
+            roots = [os.path.abspath(os.path.expanduser(name)) for name in args.file]
+            changed = {
+                path: lines
+                for path, lines in changed.items()
+                if any(
+                    os.path.commonpath([root, os.path.abspath(path)]) == root
+                    for root in roots
                 )
+            }
+        paths: Iterable[Path] = iter(changed)
+        if args.changed_lines:
+            changes = changed
+    else:
+        paths = discover(
+            [Path(name).expanduser() for name in args.file],
+            [*DEFAULT_EXCLUDES, *args.exclude],
+            not args.no_gitignore,
+        )
+    # no worker pool for a single file
+    first = list(islice(paths, 2))
+    paths = chain(first, paths)
+    run = (
+        run_parallel
+        if args.jobs > 1 and len(first) > 1
+        else functools.partial(run_serial, depth=args.prefetch)
+    )
+    results = (
+        run_remote(args.connect, paths, options, changes)
+        if args.connect
+        else run(paths, options, cache, args.jobs, changes)
+    )
+    counts: Counter = Counter()
+    writer = Writer() if args.write else None
+    profile = Profile() if args.profile else None
+    annotations: Dict[str, str] = {}
+    # output is written by a thread, so that a slow stdout does not stall work
+    output = OutputStream(sys.stdout)
+    emitter = EMITTERS[args.format](output) if args.format != "text" else None
+    try:
+        errors = False
+        with contextlib.redirect_stdout(sys.stderr if emitter else output):
+            for result in results:
+                counts[result.status] += 1
+                if profile:
+                    profile.add(result.profile)
+                if result.annotations:
+                    annotations.update(result.annotations)
+                sys.stdout.write(result.output)
+                if emitter:
+                    emitter.emit(
+                        str(result.path),
+                        result.diagnostics or [],
+                        result.changed,
+                        result.diff,
+                    )
+                if result.errors:
+                    if args.exitfirst:
+                        return 1
+                    errors = True
+                if result.changed:
+                    counts["changed"] += 1
+                    if writer and result.new_source is not None:
+                        writer.write(result.path, result.new_source, result.encoding)
+                    elif args.check:
+                        errors = True
+        if args.annotation_index:
+            write_index(args.annotation_index, annotations)
+    finally:
+        if emitter:
+            emitter.close()
+        output.close()
+        if writer:
+            writer.close()
+        if cache:
+            cache.evict()
+        if profile:
+            profile.report(sys.stderr, args.profile_top)
+            profile.write(args.profile, args.profile_top)
+        if args.stats:
+            print(
+                f"{sum(counts[s] for s in STATUSES)} files: "
+                f"{counts['parsed']} parsed, "
+                f"{counts['cached']} cached, {counts['skipped']} skipped by pre-filter, "
+                f"{counts['oversized']} oversized, "
+                f"{counts['changed']} {'rewritten' if args.write else 'to rewrite'}",
+                file=sys.stderr,
             )
-            if diff:
-                print(diff)
     if errors:
         return 1
 
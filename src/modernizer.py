@@ -1,13 +1,16 @@
 import re
 from pathlib import Path
-from typing import Dict, Optional, Set, Union, Tuple, List
+from typing import Collection, Dict, Optional, Sequence, Set, Union, Tuple, List
 
+import libcst as cst
 from libcst import (
     Arg,
     BaseExpression,
     BaseStatement,
+    BaseSuite,
     CSTNode,
     Call,
+    Import,
     ImportAlias,
     ImportStar,
     Module,
@@ -16,35 +19,230 @@ from libcst import (
     SimpleStatementLine,
     ensure_type,
     matchers as m,
-    parse_module,
-    parse_statement,
+    AsName,
     Attribute,
     Comment,
+    EmptyLine,
+    ImportFrom,
+    SimpleWhitespace,
     Param,
     TrailingWhitespace,
     Assign,
+    AssignTarget,
+    ClassDef,
     FunctionDef,
-    EmptyLine,
+    IndentedBlock,
+    Lambda,
+    CompFor,
+    ComparisonTarget,
+    For,
+    From,
+    In,
+    NotIn,
+    SimpleStatementSuite,
+    StarredElement,
+    Yield,
+)
+from libcst.metadata import (
+    BuiltinAssignment,
+    MetadataWrapper,
+    PositionProvider,
+    ScopeProvider,
+)
+
+from src.changes import overlaps
+from src.dispatch import CompiledTransformer
+from src.rules import disabled_rules, rule
+# "# type: ignore" and "# type: ignore[code]" silence mypy; they are not types
+# "# type: ignore" and "# type: ignore[code]" silence mypy, they are no types
+TYPE_COMMENT_RE = re.compile(r"#\s*type:(?!\s*ignore(?:\[|\s|$))\s*(\S*)")
+FULL_TYPE_COMMENT_RE = re.compile(r"#\s*type:(?!\s*ignore(?:\[|\s|$))\s*(.*?)\s*$")
+
+# the builtins rewritten by name, which local names can shadow
+SCOPED_NAMES = frozenset(
+    {"filter", "map", "zip", "range", "xrange", "raw_input", "unicode"}
+)
+# Calls that only iterate over some of their positional arguments, so that a
+# list() around those is not needed: the slice of these arguments. min and
+# max compare their arguments when given several.
+ITERATING_BUILTINS: Dict[str, slice] = {
+    **dict.fromkeys(
+        (
+            "all",
+            "any",
+            "dict",
+            "enumerate",
+            "frozenset",
+            "list",
+            "max",
+            "min",
+            "set",
+            "sorted",
+            "sum",
+            "tuple",
+        ),
+        slice(1),
+    ),
+    "filter": slice(1, 2),
+    "map": slice(1, None),
+    "zip": slice(None),
+}
+ITERATING_METHODS: Dict[str, slice] = {"extend": slice(1), "join": slice(1)}
+# and the ones that only need the size, which dict views and ranges have
+# (reversed() would also need views to be reversible, as of Python 3.8)
+SIZED_BUILTINS = frozenset({"len"})
+# Builtins without side effects of their own (on builtin types), which can as
+# well be called while a loop runs as all at once before it: see lazy_safe().
+PURE_BUILTINS = frozenset(
+    {
+        "abs",
+        "bool",
+        "bytes",
+        "chr",
+        "float",
+        "hex",
+        "int",
+        "len",
+        "oct",
+        "ord",
+        "range",
+        "repr",
+        "round",
+        "str",
+    }
+)
+# A superset of the places where these names can be bound: after a token that
+# can precede a binding (an assignment or for target, a parameter, an import,
+# a pattern...) and not called, or as a def or class name.
+_SCOPED = "|".join(sorted(SCOPED_NAMES))
+BINDING_RE = re.compile(
+    rf"\b(?:def|class)[ \t]+({_SCOPED})\b"
+    r"|(?:^|[,(\[{*;:=|]|\b(?:import|as|for|global|nonlocal|lambda|del|if|elif"
+    rf"|while|case|type))[ \t]*(?:\\\n[ \t]*)?\b({_SCOPED})\b(?!\s*\()",
+    re.MULTILINE,
+)
+# isinstance(s, unicode) and the like, which only read names
+CLASS_CHECK_RE = re.compile(
+    r"\b(?:isinstance|issubclass)\(\s*[\w.]+\s*,\s*(?:\([\w.,\s]*\)|[\w.]+)\s*\)"
 )
-from libcst.metadata import PositionProvider
 
 
-class Modernizer(m.MatcherDecoratableTransformer):
+def shadowable_names(source: str) -> Set[str]:
+    # The scoped names that may be bound somewhere in the module. The others
+    # are the builtins wherever they are read.
+    source = CLASS_CHECK_RE.sub("", source)
+    return {mo.group(1) or mo.group(2) for mo in BINDING_RE.finditer(source)}
+
+
+def builtin_accesses(module: Module, names: Collection[str]) -> Set[CSTNode]:
+    # The nodes reading one of the names where it can only be the builtin (or
+    # an undefined global, like Python 2 builtins): not a variable, parameter
+    # or import of the enclosing scopes, nor an attribute or keyword.
+    scopes = MetadataWrapper(module, unsafe_skip_copy=True).resolve(ScopeProvider)
+    found: Set[CSTNode] = set()
+    for scope in set(scopes.values()):
+        if scope is None:
+            continue
+        for name in names:
+            accesses = scope.accesses[name]
+            if accesses and all(isinstance(a, BuiltinAssignment) for a in scope[name]):
+                found.update(access.node for access in accesses)
+    return found
+
+
+def contains(node: CSTNode, descendant: CSTNode) -> bool:
+    return node is descendant or any(
+        contains(child, descendant) for child in node.children
+    )
+
+
+def mentioned_names(node: CSTNode) -> Set[str]:
+    return {ensure_type(n, Name).value for n in m.findall(node, m.Name())}
+
+
+def loop_changes(node: CSTNode, loop: For) -> bool:
+    # whether the loop may rebind or mutate a name the node depends on
+    return bool(
+        mentioned_names(node)
+        & (mentioned_names(loop.target) | mentioned_names(loop.body))
+    )
+
+
+def follows(block: CSTNode, assign: Assign, loop: For) -> bool:
+    # whether the loop is the statement right after the assignment's line,
+    # with the assignment last on the line
+    if not isinstance(block, IndentedBlock):
+        return False
+    body = block.body
+    for previous, statement in zip(body, body[1:]):
+        if statement is loop:
+            return (
+                isinstance(previous, SimpleStatementLine)
+                and previous.body[-1] is assign
+            )
+    return False
+
+
+def comment_type(comment: Comment) -> Optional[str]:
+    mo = FULL_TYPE_COMMENT_RE.match(comment.value)
+    return mo.group(1) if mo else None
+
+
+class _Statement:
+    def __init__(self) -> None:
+        self.vtype: Optional[str] = None
+        self.comment: Optional[Comment] = None
+        # plain variable targets of the line's assignment; a type comment on
+        # a tuple unpacking describes the tuple, so those are left out
+        self.targets: List[str] = []
+        # target names of the line's assignment, if any
+        self.names: Optional[List[str]] = None
+
+
+class _Function:
+    # Within a function, the lists assigned to a local variable that is then
+    # only iterated over by a for loop: see leave_FunctionDef.
+    def __init__(self) -> None:
+        # occurrences of each name, nested functions included
+        self.names: Dict[str, int] = {}
+        # simple assignments: value -> variable, enclosing block, assignment
+        self.assignments: Dict[CSTNode, Tuple[str, CSTNode, Assign]] = {}
+        # for loops over a variable: (variable, enclosing block) -> loop
+        self.loops: Dict[Tuple[str, CSTNode], For] = {}
+        # the assignments whose value got wrapped, and the list() calls
+        self.wrapped: List[Tuple[Tuple[str, CSTNode, Assign], Call, Call]] = []
+
+
+class Modernizer(CompiledTransformer):
     METADATA_DEPENDENCIES = (PositionProvider,)
     # FIXME use a stack of e.g. SimpleStatementLine then proper visit_Import/ImportFrom to store the ssl node
 
     def __init__(
-        self, path: Path, verbose: bool = False, ignored: Optional[List[str]] = None
+        self,
+        path: Path,
+        verbose: bool = False,
+        ignored: Optional[List[str]] = None,
+        lines: Optional[Sequence[Tuple[int, int]]] = None,
+        selected: Optional[List[str]] = None,
+        source: Optional[str] = None,
     ):
-        super().__init__()
+        super().__init__(disabled_rules(selected, ignored))
         self.path = path
         self.verbose = verbose
-        self.ignored = set(ignored or [])
+        # the module's source, if at hand: see builtin()
+        self.source = source
+        # only rewrite code on these line ranges, if given
+        self.lines = lines
         self.errors = False
-        self.stack: List[Tuple[str, ...]] = []
+        # set whenever a handler returns a new node, so that callers can skip
+        # code generation and diffing for unchanged modules
+        self.modified = False
+        # enclosing class and function names
+        self.stack: List[str] = []
         self.annotations: Dict[
             Tuple[str, ...], Comment  # key: tuple of canonical variable name
         ] = {}
+        self.lambdas = 0
         self.python_future_updated_node: Optional[SimpleStatementLine] = None
         self.python_future_imports: Dict[str, str] = {}
         self.python_future_new_imports: Set[str] = set()
@@ -56,6 +254,24 @@ class Modernizer(m.MatcherDecoratableTransformer):
         self.future_utils_updated_node: Optional[SimpleStatementLine] = None
         # self.last_import_node: Optional[CSTNode] = None
         self.last_import_node_stmt: Optional[CSTNode] = None
+        self.param_comments: List[Optional[Comment]] = []
+        self.statements: List[_Statement] = []
+        self.assign_targets = 0
+        self.messages: List[List[str]] = []
+        self.open_messages: List[List[str]] = []
+        self.module: Optional[Module] = None
+        # see builtin(); computed on first use
+        self.shadowable: Optional[Set[str]] = None
+        self.builtin_names: Optional[Set[CSTNode]] = None
+        self.attribute_names: Set[CSTNode] = set()
+        # Expressions whose value is only iterated over, or only sized, which
+        # keeps working with the iterators and views of Python 3 (see
+        # visit_iterating_call and the like); anything else gets a list().
+        self.iterated: Set[CSTNode] = set()
+        self.sized: Set[CSTNode] = set()
+        self.functions: List[_Function] = []
+        # enclosing indented blocks and statement suites
+        self.blocks: List[CSTNode] = []
 
     # @m.call_if_inside(m.ImportFrom(module=m.Name("__future__")))
     # @m.visit(m.ImportAlias() | m.ImportStar())
@@ -118,7 +334,7 @@ class Modernizer(m.MatcherDecoratableTransformer):
     @m.call_if_not_inside(m.ClassDef() | m.FunctionDef() | m.If())
     def visit_SimpleStatementLine(self, node: SimpleStatementLine) -> Optional[bool]:
         for n in node.body:
-            if m.matches(n, m.Import() | m.ImportFrom()):
+            if isinstance(n, (Import, ImportFrom)):
                 self.last_import_node_stmt = node
         return None
 
@@ -127,6 +343,9 @@ class Modernizer(m.MatcherDecoratableTransformer):
         self, original_node: SimpleStatementLine, updated_node: SimpleStatementLine
     ) -> Union[BaseStatement, RemovalSentinel]:
         for n in updated_node.body:
+            # most statements are not imports: skip the matchers for them
+            if not isinstance(n, ImportFrom):
+                continue
             if m.matches(n, m.ImportFrom(module=m.Name("__future__"))):
                 self.python_future_updated_node = updated_node
             elif m.matches(n, m.ImportFrom(module=m.Name("builtins"))):
@@ -154,136 +373,399 @@ class Modernizer(m.MatcherDecoratableTransformer):
     # def visit_assign(self, node: SimpleStatementSuite) -> None:
     #     return None
 
+    # Type comments are collected during the main traversal: a stack entry is
+    # pushed when entering a Param or a SimpleStatementLine and every
+    # TrailingWhitespace below it updates the type; the message is completed
+    # when leaving it. Messages are printed in visit order once no entry is
+    # open anymore.
+
+    def visit_ClassDef(self, node: ClassDef) -> Optional[bool]:
+        self.stack.append(node.name.value)
+        return None
+
+    def leave_ClassDef(
+        self, original_node: ClassDef, updated_node: ClassDef
+    ) -> BaseStatement:
+        self.stack.pop()
+        return updated_node
+
+    def visit_FunctionDef(self, node: FunctionDef) -> Optional[bool]:
+        self.stack.append(node.name.value)
+        self.functions.append(_Function())
+        # signature type comment, on the def line or first in the body
+        comment = None
+        if isinstance(node.body, IndentedBlock):
+            comment = node.body.header.comment
+            if not comment and node.body.body:
+                comment = next(
+                    (
+                        line.comment
+                        for line in node.body.body[0].leading_lines
+                        if line.comment
+                    ),
+                    None,
+                )
+        elif node.body.trailing_whitespace.comment:
+            comment = node.body.trailing_whitespace.comment
+        if comment and FULL_TYPE_COMMENT_RE.match(comment.value):
+            self.annotations[tuple(self.stack)] = comment
+        return None
+
+    def leave_FunctionDef(
+        self, original_node: FunctionDef, updated_node: FunctionDef
+    ) -> BaseStatement:
+        self.stack.pop()
+        function = self.functions.pop()
+        if self.functions:
+            parent = self.functions[-1].names
+            for name, count in function.names.items():
+                parent[name] = parent.get(name, 0) + count
+        # `x = list(...)` directly followed by `for ... in x:`, with x seen
+        # nowhere else: the for loop alone consumes the value, so the list()
+        # is dropped, unless the loop may change what the value depends on.
+        for (name, block, assign), call, wrapper in function.wrapped:
+            loop = function.loops.get((name, block))
+            if (
+                loop
+                and function.names[name] == 2
+                and follows(block, assign, loop)
+                and self.lazy_safe(call, loop)
+            ):
+                updated_node = ensure_type(
+                    updated_node.deep_replace(wrapper, wrapper.args[0].value),
+                    FunctionDef,
+                )
+        return updated_node
+
+    def visit_IndentedBlock(self, node: IndentedBlock) -> Optional[bool]:
+        self.blocks.append(node)
+        return None
+
+    def leave_IndentedBlock(
+        self, original_node: IndentedBlock, updated_node: IndentedBlock
+    ) -> BaseSuite:
+        self.blocks.pop()
+        return updated_node
+
+    def visit_SimpleStatementSuite(self, node: SimpleStatementSuite) -> Optional[bool]:
+        self.blocks.append(node)
+        return None
+
+    def leave_SimpleStatementSuite(
+        self, original_node: SimpleStatementSuite, updated_node: SimpleStatementSuite
+    ) -> BaseSuite:
+        self.blocks.pop()
+        return updated_node
+
+    def visit_Lambda(self, node: Lambda) -> Optional[bool]:
+        self.lambdas += 1
+        return None
+
+    def leave_Lambda(self, original_node: Lambda, updated_node: Lambda) -> Lambda:
+        self.lambdas -= 1
+        return updated_node
+
     def visit_Param(self, node: Param) -> Optional[bool]:
-        class Visitor(m.MatcherDecoratableVisitor):
-            def __init__(self):
-                super().__init__()
-                self.ptype: Optional[str] = None
-
-            def visit_TrailingWhitespace_comment(
-                self, node: "TrailingWhitespace"
-            ) -> None:
-                if node.comment and "type:" in node.comment.value:
-                    mo = re.match(r"#\s*type:\s*(\S*)", node.comment.value)
-                    self.ptype = mo.group(1) if mo else None
-                return None
-
-        v = Visitor()
-        node.visit(v)
+        self.param_comments.append(None)
+        if self.verbose:
+            self.open_message()
+        return None
+
+    def leave_Param(self, original_node: Param, updated_node: Param) -> Param:
+        comment = self.param_comments.pop()
+        mo = TYPE_COMMENT_RE.match(comment.value) if comment else None
+        ptype = mo.group(1) if mo else None
+        if comment and not self.lambdas and comment_type(comment):
+            self.annotations[(*self.stack, original_node.name.value)] = comment
         if self.verbose:
-            pos = self.get_metadata(PositionProvider, node).start
-            print(
-                f"{self.path}:{pos.line}:{pos.column}: parameter {node.name.value}: {v.ptype or 'unknown type'}"
+            pos = self.get_metadata(PositionProvider, original_node).start
+            self.close_message(
+                f"{self.path}:{pos.line}:{pos.column}: parameter {original_node.name.value}: {ptype or 'unknown type'}"
             )
+        return updated_node
+
+    def visit_TrailingWhitespace(self, node: TrailingWhitespace) -> Optional[bool]:
+        if node.comment and "type:" in node.comment.value:
+            mo = TYPE_COMMENT_RE.match(node.comment.value)
+            for i in range(len(self.param_comments)):
+                self.param_comments[i] = node.comment
+            if mo:
+                for statement in self.statements:
+                    statement.vtype = mo.group(1)
+                    statement.comment = node.comment
         return None
 
     @m.visit(m.SimpleStatementLine())
     def visit_simple_stmt(self, node: SimpleStatementLine) -> None:
-        assign = None
-        for c in node.children:
-            if m.matches(c, m.Assign()):
-                assign = ensure_type(c, Assign)
-        if assign:
-            if m.MatchIfTrue(
-                lambda n: n.trailing_whitespace.comment
-                and "type:" in n.trailing_whitespace.comment.value
-            ):
+        self.statements.append(_Statement())
+        if self.verbose:
+            self.open_message()
 
-                class TypingVisitor(m.MatcherDecoratableVisitor):
-                    def __init__(self):
-                        super().__init__()
-                        self.vtype = None
-
-                    def visit_TrailingWhitespace_comment(
-                        self, node: "TrailingWhitespace"
-                    ) -> None:
-                        if node.comment:
-                            mo = re.match(r"#\s*type:\s*(\S*)", node.comment.value)
-                            if mo:
-                                vtype = mo.group(1)
-                        return None
-
-                tv = TypingVisitor()
-                node.visit(tv)
-                vtype = tv.vtype
-            else:
-                vtype = None
-
-            class NameVisitor(m.MatcherDecoratableVisitor):
-                def __init__(self):
-                    super().__init__()
-                    self.names: List[str] = []
-
-                def visit_Name(self, node: Name) -> Optional[bool]:
-                    self.names.append(node.value)
-                    return None
-
-            if self.verbose:
-                pos = self.get_metadata(PositionProvider, node).start
-                for target in assign.targets:
-                    v = NameVisitor()
-                    target.visit(v)
-                    for name in v.names:
-                        print(
-                            f"{self.path}:{pos.line}:{pos.column}: variable {name}: {vtype or 'unknown type'}"
-                        )
-
-    def visit_FunctionDef_body(self, node: FunctionDef) -> None:
-        class Visitor(m.MatcherDecoratableVisitor):
-            def __init__(self):
-                super().__init__()
-
-            def visit_EmptyLine_comment(self, node: "EmptyLine") -> None:
-                # FIXME too many matches on test_param_02
-                if not node.comment:
-                    return
-                # TODO: use comment.value
-                return None
-
-        v = Visitor()
-        node.visit(v)
+    @m.leave(m.SimpleStatementLine())
+    def leave_simple_stmt(
+        self, original_node: SimpleStatementLine, updated_node: SimpleStatementLine
+    ) -> SimpleStatementLine:
+        statement = self.statements.pop()
+        if statement.comment:
+            for name in statement.targets:
+                self.annotations[(*self.stack, name)] = statement.comment
+        if self.verbose:
+            lines = []
+            if statement.names is not None:
+                pos = self.get_metadata(PositionProvider, original_node).start
+                for name in statement.names:
+                    lines.append(
+                        f"{self.path}:{pos.line}:{pos.column}: variable {name}: {statement.vtype or 'unknown type'}"
+                    )
+            self.close_message(*lines)
+        return updated_node
+
+    def visit_Assign(self, node: Assign) -> Optional[bool]:
+        if self.statements:
+            # the last assignment of the line wins
+            self.statements[-1].names = []
+            self.statements[-1].targets = [
+                target.target.value
+                for target in node.targets
+                if isinstance(target.target, Name)
+            ]
+        if len(node.targets) == 1:
+            target = node.targets[0].target
+            if isinstance(target, (cst.Tuple, cst.List)):
+                # unpacking
+                self.iterated.add(node.value)
+            elif isinstance(target, Name) and self.functions and self.blocks:
+                self.functions[-1].assignments[node.value] = (
+                    target.value,
+                    self.blocks[-1],
+                    node,
+                )
         return None
 
+    def visit_AssignTarget(self, node: AssignTarget) -> Optional[bool]:
+        self.assign_targets += 1
+        return None
+
+    def leave_AssignTarget(
+        self, original_node: AssignTarget, updated_node: AssignTarget
+    ) -> AssignTarget:
+        self.assign_targets -= 1
+        return updated_node
+
+    def visit_Name(self, node: Name) -> Optional[bool]:
+        if self.assign_targets and self.statements:
+            names = self.statements[-1].names
+            if names is not None:
+                names.append(node.value)
+        if self.functions:
+            counts = self.functions[-1].names
+            counts[node.value] = counts.get(node.value, 0) + 1
+        return None
+
+    def visit_Attribute(self, node: Attribute) -> Optional[bool]:
+        if self.functions:
+            # not a variable: uncounts the Name visited next
+            counts = self.functions[-1].names
+            counts[node.attr.value] = counts.get(node.attr.value, 0) - 1
+        return None
+
+    def open_message(self) -> None:
+        message: List[str] = []
+        self.messages.append(message)
+        self.open_messages.append(message)
+
+    def close_message(self, *lines: str) -> None:
+        self.open_messages.pop().extend(lines)
+        if not self.open_messages:
+            for message in self.messages:
+                for line in message:
+                    print(line)
+            self.messages = []
+
+    def visit_Module(self, node: Module) -> Optional[bool]:
+        self.module = node
+        return True
+
+    def release(self) -> None:
+        # Drops the references to the original tree, which the caller frees
+        # before code generation (see src/runner.py); libcst rebuilds every
+        # node above a change, so it would otherwise stay alive.
+        self.module = None
+        self.builtin_names = None
+        self.last_import_node_stmt = None
+        self.attribute_names = set()
+        self.iterated = set()
+        self.sized = set()
+
+    def builtin(self, node: Name) -> bool:
+        # Whether a name (other than an attribute) refers to the builtin.
+        # Scopes are only resolved, once, for modules that may bind the name;
+        # the lookups are then O(1).
+        assert self.module is not None
+        if self.shadowable is None:
+            source = self.module.code if self.source is None else self.source
+            self.shadowable = shadowable_names(source)
+        if node.value not in self.shadowable:
+            return True
+        if self.builtin_names is None:
+            self.builtin_names = builtin_accesses(self.module, self.shadowable)
+        return node in self.builtin_names
+
+    def lazy_safe(self, call: Call, loop: For) -> bool:
+        # Whether the value of the call can be computed as the loop runs
+        # rather than before: the loop does not change the names the call
+        # depends on, and the only functions the call makes are pure builtins.
+        if loop_changes(call, loop):
+            return False
+        funcs = [c.func for c in m.findall(call, m.Call()) if c is not call]
+        if isinstance(call.func, Name) and call.func.value in ("filter", "map"):
+            funcs.extend(arg.value for arg in call.args[:1])
+        return all(
+            isinstance(func, Name)
+            and (func.value == "None" or func.value in PURE_BUILTINS)
+            and self.builtin(func)
+            for func in funcs
+        )
+
+    def in_lines(self, node: CSTNode) -> bool:
+        if self.lines is None:
+            return True
+        code_range = self.get_metadata(PositionProvider, node)
+        return overlaps(self.lines, code_range.start.line, code_range.end.line)
+
+    # Where the Python 3 iterators and views need no list(): arguments of
+    # iterating_call_matcher, for loops and comprehensions, `in` tests,
+    # unpacking, star arguments and `yield from`.
+
+    iterating_call_matcher = m.Call(
+        func=m.OneOf(
+            *(m.Name(name) for name in sorted({*ITERATING_BUILTINS, *SIZED_BUILTINS}))
+        )
+        | m.Attribute(attr=m.OneOf(*(m.Name(name) for name in ITERATING_METHODS)))
+    )
+
+    @rule("map", "keys")
+    @m.visit(iterating_call_matcher)
+    def visit_iterating_call(self, node: Call) -> None:
+        if any(arg.star for arg in node.args):
+            return
+        args = [arg.value for arg in node.args if not arg.keyword]
+        if isinstance(node.func, Attribute):
+            self.iterated.update(args[ITERATING_METHODS[node.func.attr.value]])
+            return
+        # taken for the builtins, like list() always was: rebinding these
+        # names is rare, and resolving scopes for them costly
+        func = ensure_type(node.func, Name)
+        if func.value in SIZED_BUILTINS:
+            self.sized.update(args[:1])
+        elif func.value not in ("max", "min") or len(args) == 1:
+            self.iterated.update(args[ITERATING_BUILTINS[func.value]])
+
+    # iterators and views that the body of a loop over them could invalidate;
+    # range() takes its arguments at once
+    lazy_matcher = m.Call(
+        func=m.Name("filter")
+        | m.Name("map")
+        | m.Name("zip")
+        | m.Attribute(attr=m.Name("keys") | m.Name("values") | m.Name("items"))
+    )
+
+    @rule("map", "keys")
+    def visit_For(self, node: For) -> Optional[bool]:
+        if isinstance(node.iter, Name):
+            if self.functions and self.blocks:
+                loops = self.functions[-1].loops
+                loops[(node.iter.value, self.blocks[-1])] = node
+        elif not (
+            m.matches(node.iter, self.lazy_matcher) and loop_changes(node.iter, node)
+        ):
+            self.iterated.add(node.iter)
+        return None
+
+    @rule("map", "keys")
+    def visit_CompFor(self, node: CompFor) -> Optional[bool]:
+        self.iterated.add(node.iter)
+        return None
+
+    @rule("map", "keys")
+    def visit_ComparisonTarget(self, node: ComparisonTarget) -> Optional[bool]:
+        if isinstance(node.operator, (In, NotIn)):
+            self.iterated.add(node.comparator)
+        return None
+
+    @rule("map", "keys")
+    def visit_StarredElement(self, node: StarredElement) -> Optional[bool]:
+        self.iterated.add(node.value)
+        return None
+
+    @rule("map", "keys")
+    def visit_Arg(self, node: Arg) -> Optional[bool]:
+        if node.star == "*":
+            self.iterated.add(node.value)
+        return None
+
+    @rule("map", "keys")
+    def visit_Yield(self, node: Yield) -> Optional[bool]:
+        if isinstance(node.value, From):
+            self.iterated.add(node.value.item)
+        return None
+
+    def wrap(self, original_node: Call, updated_node: Call) -> Call:
+        # list(updated_node), remembering where it is assigned to a variable
+        wrapper = Call(func=Name("list"), args=[Arg(updated_node)])
+        if self.functions:
+            assignment = self.functions[-1].assignments.get(original_node)
+            if assignment:
+                self.functions[-1].wrapped.append((assignment, original_node, wrapper))
+        self.modified = True
+        return wrapper
+
     map_matcher = m.Call(
         func=m.Name("filter") | m.Name("map") | m.Name("zip") | m.Name("range")
     )
 
+    @rule("map")
     @m.visit(map_matcher)
     def visit_map(self, node: Call) -> None:
+        if not self.in_lines(node) or not self.builtin(ensure_type(node.func, Name)):
+            return
         func_name = ensure_type(node.func, Name).value
         if func_name not in self.builtins_imports:
             self.builtins_new_imports.add(func_name)
 
-    @m.call_if_not_inside(
-        m.Call(
-            func=m.Name("list")
-            | m.Name("set")
-            | m.Name("tuple")
-            | m.Attribute(attr=m.Name("join"))
-        )
-        | m.CompFor()
-        | m.For()
-    )
+    @rule("map")
     @m.leave(map_matcher)
     def fix_map(self, original_node: Call, updated_node: Call) -> BaseExpression:
-        # TODO test with CompFor etc.
-        # TODO improve join test
         func_name = ensure_type(updated_node.func, Name).value
-        if func_name not in self.builtins_imports:
-            updated_node = Call(func=Name("list"), args=[Arg(updated_node)])
+        if (
+            func_name not in self.builtins_imports
+            and original_node not in self.iterated
+            and (func_name != "range" or original_node not in self.sized)
+            and self.in_lines(original_node)
+            and self.builtin(ensure_type(original_node.func, Name))
+        ):
+            return self.wrap(original_node, updated_node)
         return updated_node
 
+    @rule("xrange")
     @m.visit(m.Call(func=m.Name("xrange") | m.Name("raw_input")))
     def visit_xrange(self, node: Call) -> None:
+        if not self.in_lines(node) or not self.builtin(ensure_type(node.func, Name)):
+            return
         orig_func_name = ensure_type(node.func, Name).value
         func_name = "range" if orig_func_name == "xrange" else "input"
         if func_name not in self.builtins_imports:
             self.builtins_new_imports.add(func_name)
 
+    @rule("xrange")
     @m.leave(m.Call(func=m.Name("xrange") | m.Name("raw_input")))
     def fix_xrange(self, original_node: Call, updated_node: Call) -> BaseExpression:
+        func = ensure_type(original_node.func, Name)
+        if not self.in_lines(original_node) or not self.builtin(func):
+            return updated_node
         orig_func_name = ensure_type(updated_node.func, Name).value
         func_name = "range" if orig_func_name == "xrange" else "input"
+        self.modified = True
         return updated_node.with_changes(func=Name(func_name))
 
     iter_matcher = m.Call(
@@ -292,115 +774,209 @@ class Modernizer(m.MatcherDecoratableTransformer):
         )
     )
 
+    @rule("iterkeys")
     @m.visit(iter_matcher)
     def visit_iter(self, node: Call) -> None:
+        if not self.in_lines(node):
+            return
         func_name = ensure_type(node.func, Attribute).attr.value
         if func_name not in self.future_utils_imports:
             self.future_utils_new_imports.add(func_name)
 
+    @rule("iterkeys")
     @m.leave(iter_matcher)
     def fix_iter(self, original_node: Call, updated_node: Call) -> BaseExpression:
+        if not self.in_lines(original_node):
+            return updated_node
         attribute = ensure_type(updated_node.func, Attribute)
         func_name = attribute.attr
         dict_name = attribute.value
+        self.modified = True
         return updated_node.with_changes(func=func_name, args=[Arg(dict_name)])
 
     not_iter_matcher = m.Call(
         func=m.Attribute(attr=m.Name("keys") | m.Name("values") | m.Name("items"))
     )
 
-    @m.call_if_not_inside(
-        m.Call(
-            func=m.Name("list")
-            | m.Name("set")
-            | m.Name("tuple")
-            | m.Attribute(attr=m.Name("join"))
-        )
-        | m.CompFor()
-        | m.For()
-    )
+    @rule("keys")
     @m.leave(not_iter_matcher)
     def fix_not_iter(self, original_node: Call, updated_node: Call) -> BaseExpression:
-        updated_node = Call(func=Name("list"), args=[Arg(updated_node)])
-        return updated_node
-
+        if (
+            original_node in self.iterated
+            or original_node in self.sized
+            or not self.in_lines(original_node)
+        ):
+            return updated_node
+        return self.wrap(original_node, updated_node)
+
+    @rule("unicode")
+    @m.visit(m.Attribute(attr=m.Name("unicode")))
+    def visit_unicode_attribute(self, node: Attribute) -> None:
+        self.attribute_names.add(node.attr)
+
+    @rule("unicode")
     @m.call_if_not_inside(m.Import() | m.ImportFrom())
     @m.leave(m.Name(value="unicode"))
     def fix_unicode(self, original_node: Name, updated_node: Name) -> BaseExpression:
+        if (
+            not self.in_lines(original_node)
+            or original_node in self.attribute_names
+            or not self.builtin(original_node)
+        ):
+            return updated_node
         value = "text_type"
         if value not in self.future_utils_imports:
             self.future_utils_new_imports.add(value)
+        self.modified = True
         return updated_node.with_changes(value=value)
 
     def leave_Module(self, original_node: Module, updated_node: Module) -> Module:
-        updated_node = self.update_imports(
-            original_node,
-            updated_node,
-            "builtins",
-            self.builtins_updated_node,
-            self.builtins_imports,
-            self.builtins_new_imports,
-            True,
-        )
-        updated_node = self.update_imports(
-            original_node,
-            updated_node,
-            "future.utils",
-            self.future_utils_updated_node,
-            self.future_utils_imports,
-            self.future_utils_new_imports,
-            False,
-        )
+        last_import = self.last_import_node_stmt
+        self.release()
+        # All import changes are spliced into the module body at once: new
+        # import lines go after the last top-level import (or at the top,
+        # followed by two blank lines), existing ones are replaced in place.
+        new_lines: List[SimpleStatementLine] = []
+        replacements: List[Tuple[SimpleStatementLine, SimpleStatementLine]] = []
+        for import_name, updated_import_node, current_imports, new_imports, noqa in (
+            (
+                "builtins",
+                self.builtins_updated_node,
+                self.builtins_imports,
+                self.builtins_new_imports,
+                True,
+            ),
+            (
+                "future.utils",
+                self.future_utils_updated_node,
+                self.future_utils_imports,
+                self.future_utils_new_imports,
+                False,
+            ),
+        ):
+            if not new_imports:
+                continue
+            if not updated_import_node:
+                new_lines.append(
+                    SimpleStatementLine(
+                        [import_from(import_name, new_imports, {})],
+                        trailing_whitespace=noqa_whitespace(None, noqa),
+                    )
+                )
+            elif "*" not in current_imports:
+                replacements.append(
+                    (
+                        updated_import_node,
+                        self.update_imports(
+                            updated_import_node,
+                            import_name,
+                            current_imports,
+                            new_imports,
+                            noqa,
+                        ),
+                    )
+                )
+        if not new_lines and not replacements:
+            return updated_node
+        self.modified = True
+        body = list(updated_node.body)
+        nested = []
+        for old, new in replacements:
+            for i, stmt in enumerate(body):
+                if stmt is old:
+                    body[i] = new
+                    break
+            else:
+                nested.append((old, new))
+        if new_lines:
+            # after the top-level statement holding the last import, which may
+            # be nested (e.g. in a try block), else after the docstring
+            i = 0
+            if last_import:
+                for j, original in enumerate(original_node.body):
+                    if contains(original, last_import):
+                        i = j + 1
+                        break
+            if i == 0:
+                if original_node.get_docstring(clean=False) is not None:
+                    i = 1
+                    new_lines[0] = new_lines[0].with_changes(
+                        leading_lines=[EmptyLine()]
+                    )
+                if i < len(body):
+                    leading_lines = list(body[i].leading_lines)
+                    while leading_lines and not leading_lines[0].comment:
+                        leading_lines.pop(0)
+                    body[i] = body[i].with_changes(
+                        leading_lines=[EmptyLine(), EmptyLine(), *leading_lines]
+                    )
+            body[i:i] = new_lines
+        updated_node = updated_node.with_changes(body=body)
+        for old, new in nested:
+            # e.g. in a try block
+            updated_node = ensure_type(updated_node.deep_replace(old, new), Module)
         return updated_node
 
+    @staticmethod
     def update_imports(
-        self,
-        original_module: Module,
-        updated_module: Module,
-        import_name: str,
         updated_import_node: SimpleStatementLine,
+        import_name: str,
         current_imports: Dict[str, str],
         new_imports: Set[str],
         noqa: bool,
-    ) -> Module:
-        if not new_imports:
-            return updated_module
-        noqa_comment = "  # noqa" if noqa else ""
-        if not updated_import_node:
-            i = -1
-            blank_lines = "\n\n"
-            if self.last_import_node_stmt:
-                blank_lines = ""
-                for i, (original, updated) in enumerate(
-                    zip(original_module.body, updated_module.body)
-                ):
-                    if original is self.last_import_node_stmt:
-                        break
-            stmt = parse_module(
-                f"from {import_name} import {', '.join(sorted(new_imports))}{noqa_comment}\n{blank_lines}",
-                config=updated_module.config_for_parsing,
-            )
-            body = list(updated_module.body)
-            self.last_import_node_stmt = stmt
-            return updated_module.with_changes(
-                body=body[: i + 1] + stmt.children + body[i + 1 :]
-            )
-        else:
-            if "*" not in current_imports:
-                current_imports_set = {
-                    f"{k}" if k == v else f"{k} as {v}"
-                    for k, v in current_imports.items()
-                }
-                stmt = parse_statement(
-                    f"from {import_name} import {', '.join(sorted(new_imports | current_imports_set))}{noqa_comment}"
-                )
-                return updated_module.deep_replace(updated_import_node, stmt)
-                # for i, (original, updated) in enumerate(
-                #     zip(original_module.body, updated_module.body)
-                # ):
-                #     if original is original_import_node:
-                #         body = list(updated_module.body)
-                #         return updated_module.with_changes(
-                #             body=body[:i] + [stmt] + body[i + 1 :]
-                #         )
-        return updated_module
+    ) -> SimpleStatementLine:
+        body = [
+            import_from(import_name, new_imports, current_imports)
+            if m.matches(n, m.ImportFrom(module=dotted_name_matcher(import_name)))
+            else n
+            for n in updated_import_node.body
+        ]
+        return updated_import_node.with_changes(
+            body=body,
+            trailing_whitespace=noqa_whitespace(
+                updated_import_node.trailing_whitespace, noqa
+            ),
+        )
+
+
+def dotted_name(name: str) -> Union[Name, Attribute]:
+    node: Union[Name, Attribute] = Name(name.split(".")[0])
+    for part in name.split(".")[1:]:
+        node = Attribute(node, Name(part))
+    return node
+
+
+def dotted_name_matcher(name: str) -> Union[m.Name, m.Attribute]:
+    node: Union[m.Name, m.Attribute] = m.Name(name.split(".")[0])
+    for part in name.split(".")[1:]:
+        node = m.Attribute(value=node, attr=m.Name(part))
+    return node
+
+
+def import_from(
+    import_name: str, new_imports: Set[str], current_imports: Dict[str, str]
+) -> ImportFrom:
+    # `from import_name import a, b as c`, sorted like the written names
+    aliases = {name: name for name in new_imports}
+    aliases.update(current_imports)
+    names = sorted(
+        aliases.items(),
+        key=lambda item: item[0] if item[0] == item[1] else " as ".join(item),
+    )
+    return ImportFrom(
+        module=dotted_name(import_name),
+        names=[
+            ImportAlias(Name(name), None if name == alias else AsName(Name(alias)))
+            for name, alias in names
+        ],
+    )
+
+
+def noqa_whitespace(
+    whitespace: Optional[TrailingWhitespace], noqa: bool
+) -> TrailingWhitespace:
+    if whitespace and (not noqa or whitespace.comment):
+        return whitespace
+    if noqa:
+        return TrailingWhitespace(SimpleWhitespace("  "), Comment("# noqa"))
+    return TrailingWhitespace()
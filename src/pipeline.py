@@ -0,0 +1,85 @@
+import io
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Deque, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from src.runner import read_source
+
+# The I/O ends of the serial pipeline: files are read ahead by a few threads
+# while the current one is processed, and output is written by another thread,
+# so that neither slow reads nor a slow reader of stdout stall the CPU work.
+
+
+def prefetch(
+    paths: Iterable[Path], depth: int = 8, threads: int = 4
+) -> Iterator[Tuple[Path, "Future[Tuple[str, str]]"]]:
+    # Yields each path, in order, with the future of its (source, encoding),
+    # keeping up to `depth` reads in flight. Read errors are raised by the
+    # futures' result().
+    pending: Deque[Tuple[Path, "Future[Tuple[str, str]]"]] = deque()
+    path_iter = iter(paths)
+    with ThreadPoolExecutor(max_workers=max(1, min(depth, threads))) as executor:
+        try:
+            while True:
+                while len(pending) < depth:
+                    path = next(path_iter, None)
+                    if path is None:
+                        break
+                    pending.append((path, executor.submit(read_source, path)))
+                if not pending:
+                    return
+                yield pending.popleft()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+class OutputStream(io.TextIOBase):
+    # Writes to `stream` from a background thread, through a bounded queue.
+    # A write error (e.g. a closed pipe) stops the output and is re-raised by
+    # the next write() or by close().
+
+    def __init__(self, stream: TextIO, maxsize: int = 1024):
+        super().__init__()
+        self.stream = stream
+        self.queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize)
+        self.failures: List[OSError] = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        if self.failures:
+            raise self.failures[0]
+        if s:
+            self.queue.put(s)
+        return len(s)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+            super().close()
+        if self.failures:
+            raise self.failures[0]
+
+    def _run(self) -> None:
+        while True:
+            s = self.queue.get()
+            if s is None:
+                break
+            if self.failures:
+                continue
+            try:
+                self.stream.write(s)
+            except OSError as e:
+                self.failures.append(e)
+        try:
+            self.stream.flush()
+        except OSError as e:
+            self.failures.append(e)
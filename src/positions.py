@@ -0,0 +1,72 @@
+from typing import Dict, Iterable, Set
+
+from libcst import CSTNode, MetadataWrapper, Module
+from libcst.metadata import CodeRange, PositionProvider
+
+# Positions of a few nodes, without a MetadataWrapper. PositionProvider
+# generates the code of the whole module to compute the position of every
+# node; here generation stops as soon as the requested nodes are placed.
+# This relies on libcst internals; without them, PositionProvider is
+# resolved as usual.
+
+try:
+    from libcst.metadata.position_provider import PositionProvidingCodegenState
+except ImportError:
+    PositionProvidingCodegenState = None
+
+
+class _Done(Exception):
+    pass
+
+
+if PositionProvidingCodegenState is not None:
+
+    class _PositionState(PositionProvidingCodegenState):
+        targets: Set[CSTNode]
+
+        def after_codegen(self, node: CSTNode) -> None:
+            super().after_codegen(node)
+            targets = self.targets
+            if node in targets:
+                targets.discard(node)
+                if not targets:
+                    raise _Done()
+
+
+def _fast_positions(module: Module, targets: Set[CSTNode]) -> Dict[CSTNode, CodeRange]:
+    provider = PositionProvider()
+    state = _PositionState(
+        default_indent=module.default_indent,
+        default_newline=module.default_newline,
+        provider=provider,
+    )
+    state.targets = set(targets)
+    try:
+        module._codegen(state)
+    except Exception:
+        # _Done, possibly replaced by an error from an enclosing node
+        # whose position is being recorded; either way, we are done
+        if state.targets:
+            raise
+    computed = provider._computed
+    return {node: computed[node] for node in targets}
+
+
+FAST = (
+    PositionProvidingCodegenState is not None
+    and hasattr(Module, "_codegen")
+    and hasattr(PositionProvider(), "_computed")
+)
+
+
+def positions(module: Module, nodes: Iterable[CSTNode]) -> Dict[CSTNode, CodeRange]:
+    # the nodes must belong to the module (CSTNode hashes by identity)
+    targets = set(nodes)
+    if not targets:
+        return {}
+    if FAST:
+        return _fast_positions(module, targets)
+    computed = MetadataWrapper(module, unsafe_skip_copy=True).resolve(
+        PositionProvider
+    )
+    return {node: computed[node] for node in targets}
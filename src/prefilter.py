@@ -0,0 +1,59 @@
+import io
+import re
+import tokenize
+
+# Every Checker diagnostic and Modernizer rewrite is triggered by one of these
+# names or operators (see tests/test_prefilter.py, which derives the names
+# from the registered matchers). A file whose tokens contain none of them
+# cannot produce any output outside of verbose mode, so it need not be parsed.
+TRIGGER_NAMES = frozenset(
+    {
+        # Checker
+        "maxint",
+        "assertEquals",
+        "assertItemsEqual",
+        # Modernizer
+        "filter",
+        "map",
+        "zip",
+        "range",
+        "xrange",
+        "raw_input",
+        "iterkeys",
+        "itervalues",
+        "iteritems",
+        "keys",
+        "values",
+        "items",
+        "unicode",
+    }
+)
+TRIGGER_OPS = frozenset({"/"})
+
+_quick_re = re.compile(
+    r"/|\b(?:" + "|".join(sorted(TRIGGER_NAMES, key=len, reverse=True)) + r")\b"
+)
+
+
+def may_match(source: str) -> bool:
+    # The regex is a superset of the token scan (it also hits comments and
+    # strings), so it is used first to reject most files cheaply.
+    if not _quick_re.search(source):
+        return False
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type == tokenize.NAME:
+                if token.string in TRIGGER_NAMES:
+                    return True
+            elif token.type == tokenize.OP:
+                if token.string in TRIGGER_OPS:
+                    return True
+            elif token.type == tokenize.STRING:
+                # f-string replacement fields are code for libcst
+                prefix = token.string[: token.string.find(token.string[-1])]
+                if "f" in prefix.lower() and _quick_re.search(token.string):
+                    return True
+    except (tokenize.TokenError, SyntaxError):
+        # let the parser report it
+        return True
+    return False
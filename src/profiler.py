@@ -0,0 +1,141 @@
+import functools
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, TextIO
+
+if TYPE_CHECKING:
+    from libcst import CSTVisitor
+
+
+class FileProfile:
+    def __init__(self, path: Path):
+        self.path = str(path)
+        self.pid = os.getpid()
+        # name, start (µs, system-wide monotonic clock), wall and cpu time (s)
+        self.phases: List[List[Any]] = []
+        # handler name -> [calls, wall time (s)]
+        self.handlers: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.phases.append(
+                [name, start * 1e6, end - start, time.process_time() - cpu]
+            )
+
+    def instrument(self, visitor: "CSTVisitor") -> None:
+        # Wraps the handlers on the instance, where the dispatch looks them up.
+        prefix = type(visitor).__name__
+        for name in visitor.handler_names():  # type: ignore
+            setattr(
+                visitor, name, self._wrap(f"{prefix}.{name}", getattr(visitor, name))
+            )
+
+    def _wrap(self, name: str, func: Callable) -> Callable:
+        stats = self.handlers.setdefault(name, [0, 0.0])
+
+        @functools.wraps(func)
+        def wrapper(*args: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                stats[0] += 1
+                stats[1] += time.perf_counter() - start
+
+        return wrapper
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "pid": self.pid,
+            "phases": self.phases,
+            "handlers": {k: v for k, v in self.handlers.items() if v[0]},
+        }
+
+
+class NullProfile:
+    def phase(self, name: str) -> "nullcontext[None]":
+        return nullcontext()
+
+    def instrument(self, visitor: "CSTVisitor") -> None:
+        pass
+
+    def as_dict(self) -> None:
+        return None
+
+
+class Profile:
+    def __init__(self) -> None:
+        self.files: List[Dict[str, Any]] = []
+
+    def add(self, file_profile: Optional[Dict[str, Any]]) -> None:
+        if file_profile:
+            self.files.append(file_profile)
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        phases: Dict[str, List[float]] = {}
+        handlers: Dict[str, List[float]] = {}
+        files = []
+        for f in self.files:
+            wall = cpu = 0.0
+            for name, _, phase_wall, phase_cpu in f["phases"]:
+                totals = phases.setdefault(name, [0.0, 0.0])
+                totals[0] += phase_wall
+                totals[1] += phase_cpu
+                wall += phase_wall
+                cpu += phase_cpu
+            for name, (calls, handler_wall) in f["handlers"].items():
+                totals = handlers.setdefault(name, [0, 0.0])
+                totals[0] += calls
+                totals[1] += handler_wall
+            files.append({"path": f["path"], "wall": wall, "cpu": cpu})
+        files.sort(key=lambda f: f["wall"], reverse=True)
+        return {
+            "files": len(self.files),
+            "phases": {k: {"wall": v[0], "cpu": v[1]} for k, v in phases.items()},
+            "handlers": {
+                k: {"calls": v[0], "wall": v[1]}
+                for k, v in sorted(handlers.items(), key=lambda i: -i[1][1])
+            },
+            "slowest": files[:top],
+        }
+
+    def report(self, stream: TextIO, top: int = 10) -> None:
+        summary = self.summary(top)
+        print(f"{summary['files']} files profiled", file=stream)
+        print(f"{'phase':<32}{'wall (s)':>12}{'cpu (s)':>12}", file=stream)
+        for name, t in summary["phases"].items():
+            print(f"{name:<32}{t['wall']:12.3f}{t['cpu']:12.3f}", file=stream)
+        print(f"\n{'handler':<40}{'calls':>10}{'wall (s)':>12}", file=stream)
+        for name, h in summary["handlers"].items():
+            print(f"{name:<40}{h['calls']:10d}{h['wall']:12.3f}", file=stream)
+        print(f"\nslowest {len(summary['slowest'])} files (wall s, cpu s):", file=stream)
+        for f in summary["slowest"]:
+            print(f"{f['wall']:10.3f}{f['cpu']:10.3f}  {f['path']}", file=stream)
+
+    def write(self, path: Path, top: int = 10) -> None:
+        # Chrome trace event format; the extra keys are ignored by trace viewers.
+        events = [
+            {
+                "name": name,
+                "cat": "phase",
+                "ph": "X",
+                "ts": start,
+                "dur": wall * 1e6,
+                "pid": f["pid"],
+                "tid": f["pid"],
+                "args": {"path": f["path"], "cpu": cpu},
+            }
+            for f in self.files
+            for name, start, wall, cpu in f["phases"]
+        ]
+        data = {"traceEvents": events, "summary": self.summary(top)}
+        path.write_text(json.dumps(data) + "\n")
@@ -0,0 +1,58 @@
+from typing import Callable, FrozenSet, Iterable, NamedTuple, Optional, TypeVar
+
+# The registry of rules. Each Checker check and Modernizer transform is a
+# rule; its handlers are tagged with @rule, and those of disabled rules are
+# left out of the dispatch tables (see src/dispatch.py).
+
+
+class Rule(NamedTuple):
+    name: str
+    kind: str  # "check" or "rewrite"
+    description: str
+
+
+RULES = {
+    r.name: r
+    for r in [
+        Rule(
+            "division", "check", "division without `from __future__ import division`"
+        ),
+        Rule("sys.maxint", "check", "use of sys.maxint"),
+        Rule("assertEquals", "check", "use of assertEquals"),
+        Rule("assertItemsEqual", "check", "use of assertItemsEqual"),
+        Rule("map", "rewrite", "list() around map, filter, zip and range calls"),
+        Rule("xrange", "rewrite", "xrange and raw_input to range and input"),
+        Rule("iterkeys", "rewrite", "d.iterkeys() etc. to future.utils iterkeys(d)"),
+        Rule("keys", "rewrite", "list() around keys, values and items calls"),
+        Rule("unicode", "rewrite", "unicode to future.utils text_type"),
+    ]
+}
+
+RULE_ATTR = "_cst_test_rules"
+
+F = TypeVar("F", bound=Callable)
+
+
+def rule(*names: str) -> Callable[[F], F]:
+    # the handler only runs if one of these rules is enabled
+    for name in names:
+        assert name in RULES, name
+
+    def decorator(func: F) -> F:
+        setattr(func, RULE_ATTR, names)
+        return func
+
+    return decorator
+
+
+def unknown_rules(names: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(names) - RULES.keys()
+
+
+def disabled_rules(
+    selected: Optional[Iterable[str]] = None, ignored: Optional[Iterable[str]] = None
+) -> FrozenSet[str]:
+    disabled = frozenset(ignored or ())
+    if selected is not None:
+        disabled |= RULES.keys() - frozenset(selected)
+    return disabled
@@ -0,0 +1,342 @@
+import contextlib
+import io
+import os
+import sys
+import tokenize
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from src.cache import ModuleCache, ResultCache
+from src.diagnostics import Diagnostic, format_text
+from src.prefilter import may_match
+from src.profiler import FileProfile, NullProfile
+
+
+class Options(NamedTuple):
+    verbose: bool = False
+    quiet: bool = False
+    exitfirst: bool = False
+    ignored: Optional[List[str]] = None
+    prefilter: bool = True
+    write: bool = False
+    profile: bool = False
+    # in bytes (main() takes KiB), 0 for no limit
+    max_size: int = 0
+    # what to do with larger files: "check" (diagnostics only), "warn", "skip"
+    oversized: str = "check"
+    # diagnostics only, no rewriting
+    check_only: bool = False
+    # diagnostics and diffs are returned in FileResult, not printed
+    structured: bool = False
+    # the only rules to run (see src/rules.py), None for all
+    selected: Optional[List[str]] = None
+    # return the type comments, for the annotation index
+    annotations: bool = False
+
+    def fingerprint(self) -> List[str]:
+        return [
+            f"verbose={self.verbose}",
+            f"quiet={self.quiet}",
+            f"exitfirst={self.exitfirst}",
+            f"ignored={sorted(set(self.ignored or []))}",
+            f"write={self.write}",
+            f"max_size={self.max_size}",
+            f"oversized={self.oversized}",
+            f"check_only={self.check_only}",
+            f"structured={self.structured}",
+            f"selected={None if self.selected is None else sorted(set(self.selected))}",
+            f"annotations={self.annotations}",
+        ]
+
+
+class FileResult(NamedTuple):
+    path: Path
+    output: str
+    errors: bool
+    status: str = "parsed"  # or "cached", "skipped", "oversized"
+    changed: bool = False
+    # only set with Options.write
+    new_source: Optional[str] = None
+    encoding: str = "utf-8"
+    # FileProfile.as_dict(), with Options.profile
+    profile: Optional[Dict[str, Any]] = None
+    # type comments by qualified name
+    annotations: Optional[Dict[str, str]] = None
+    # Diagnostic tuples, and with Options.structured the diff
+    diagnostics: Optional[List[Diagnostic]] = None
+    diff: Optional[str] = None
+
+
+class _Outcome(NamedTuple):
+    errors: bool
+    changed: bool = False
+    new_source: Optional[str] = None
+    annotations: Optional[Dict[str, str]] = None
+    diagnostics: Optional[List[Diagnostic]] = None
+    diff: Optional[str] = None
+
+
+class _Tee(io.TextIOBase):
+    def __init__(self, *streams: TextIO):
+        self.streams = streams
+
+    def write(self, s: str) -> int:
+        for stream in self.streams:
+            stream.write(s)
+        return len(s)
+
+
+def process_file(
+    path: Path,
+    options: Options,
+    cache: Optional[ResultCache] = None,
+    stream: Optional[TextIO] = None,
+    source: Optional[str] = None,
+    lines: Optional[Sequence[Tuple[int, int]]] = None,
+    encoding: str = "utf-8",
+) -> FileResult:
+    # Without a stream, output is captured so that results computed in worker
+    # processes can be printed by the parent in a deterministic order. With
+    # one, it is written as it is produced and the result's output is empty.
+    # `source` is used instead of the file's contents if given, with
+    # `encoding` for writing it back. With `lines`, diagnostics and rewrites
+    # are limited to those line ranges.
+    profile: Union[FileProfile, NullProfile] = (
+        FileProfile(path) if options.profile else NullProfile()
+    )
+    if source is None:
+        with profile.phase("read"):
+            py_source, encoding = read_source(path)
+    else:
+        py_source = source
+    size = source_size(py_source, encoding) if options.max_size else 0
+    oversized = size > options.max_size > 0
+    if oversized and options.oversized != "check":
+        output = ""
+        if options.oversized == "warn":
+            output = (
+                f"{path}: skipped, {size} bytes (more than {options.max_size})\n"
+            )
+        if stream:
+            stream.write(output)
+            output = ""
+        return FileResult(
+            path,
+            output,
+            False,
+            "oversized",
+            encoding=encoding,
+            profile=profile.as_dict(),
+        )
+    if options.prefilter and not options.verbose:
+        with profile.phase("prefilter"):
+            skip = not may_match(py_source)
+        if skip:
+            return FileResult(
+                path, "", False, "skipped", encoding=encoding, profile=profile.as_dict()
+            )
+    if cache:
+        with profile.phase("cache"):
+            extra = ""
+            if lines is not None:
+                extra = "lines=" + ",".join(f"{first}-{last}" for first, last in lines)
+            key = cache.key(path, py_source, extra)
+            cached = cache.get(key)
+        if cached:
+            if stream:
+                stream.write(cached["output"])
+                cached["output"] = ""
+            return FileResult(
+                path,
+                **cached,
+                status="cached",
+                encoding=encoding,
+                profile=profile.as_dict(),
+            )
+    captured = io.StringIO() if cache or not stream else None
+    if stream and captured:
+        out: TextIO = _Tee(stream, captured)
+    else:
+        out = stream or captured
+    with contextlib.redirect_stdout(out):
+        outcome = _process(
+            path,
+            py_source,
+            options,
+            profile,
+            options.check_only or bool(oversized),
+            lines,
+            cache.modules if cache else None,
+        )
+    output = captured.getvalue() if captured else ""
+    if cache:
+        cache.put(key, output=output, **outcome._asdict())
+    return FileResult(
+        path,
+        "" if stream else output,
+        outcome.errors,
+        "parsed",
+        outcome.changed,
+        outcome.new_source,
+        encoding,
+        profile.as_dict(),
+        outcome.annotations,
+        outcome.diagnostics,
+        outcome.diff,
+    )
+
+
+def process_file_in(cwd: str, *args: Any) -> FileResult:
+    # for long-lived worker processes serving clients in other directories
+    if os.getcwd() != cwd:
+        os.chdir(cwd)
+    return process_file(*args)
+
+
+def read_source(path: Path) -> Tuple[str, str]:
+    # Decoded like the interpreter would, without newline translation, so that
+    # written files keep their encoding and line endings.
+    data = path.read_bytes()
+    encoding, _ = tokenize.detect_encoding(iter(data.splitlines(True)).__next__)
+    return data.decode(encoding), encoding
+
+
+def source_size(source: str, encoding: str) -> int:
+    # the size of the file, without encoding ASCII sources
+    if source.isascii():
+        return len(source)
+    return len(source.encode(encoding, errors="surrogateescape"))
+
+
+def _process(
+    path: Path,
+    py_source: str,
+    options: Options,
+    profile: Union[FileProfile, NullProfile],
+    check_only: bool = False,
+    lines: Optional[Sequence[Tuple[int, int]]] = None,
+    modules: Optional[ModuleCache] = None,
+) -> _Outcome:
+    # Imported here: files skipped by the pre-filter or found in the cache
+    # never need libcst, which dominates startup.
+    import libcst as cst
+
+    from src.annotations import qualified_annotations
+    from src.checker import Checker
+    from src.engine import Engine
+    from src.modernizer import Modernizer, comment_type
+
+    if options.verbose:
+        print(f"Checking {path}")
+    module = None
+    if modules:
+        with profile.phase("load"):
+            key = modules.key(py_source)
+            module = modules.get(key)
+    if module is None:
+        with profile.phase("parse"):
+            module = cst.parse_module(py_source)
+        if modules:
+            with profile.phase("store"):
+                modules.put(key, module)
+    if check_only:
+        # no metadata: positions are only computed for reported nodes
+        checker = Checker(
+            path,
+            options.verbose,
+            options.ignored,
+            lazy_positions=True,
+            lines=lines,
+            selected=options.selected,
+        )
+        profile.instrument(checker)
+        with profile.phase("visit"):
+            module.visit(checker)
+        with profile.phase("positions"):
+            checker.flush(module)
+        if not options.structured:
+            sys.stdout.write(format_text(checker.diagnostics))
+        return _Outcome(checker.errors, diagnostics=checker.diagnostics)
+    # The parser never shares nodes between places in the tree, so the
+    # wrapper's defensive deep copy of the whole module can be skipped.
+    wrapper = cst.MetadataWrapper(module, unsafe_skip_copy=True)
+    del module
+    checker = Checker(
+        path, options.verbose, options.ignored, lines=lines, selected=options.selected
+    )
+    modernizer = Modernizer(
+        path, options.verbose, options.ignored, lines, options.selected, py_source
+    )
+    engine = Engine([checker], modernizer)
+    profile.instrument(checker)
+    profile.instrument(modernizer)
+    with profile.phase("metadata"):
+        for visitor in engine.visitors:
+            wrapper.resolve_many(visitor.get_inherited_dependencies())
+    with profile.phase("visit"):
+        modified_tree = wrapper.visit(engine)
+    # only the parts of the original tree the transformer kept are still needed
+    del wrapper
+    diagnostics = checker.diagnostics
+    if not options.structured:
+        sys.stdout.write(format_text(diagnostics))
+    if checker.errors and options.exitfirst:
+        engine.flush(1)
+        return _Outcome(True, diagnostics=diagnostics)
+    engine.flush()
+    if modernizer.errors and options.exitfirst:
+        return _Outcome(True, diagnostics=diagnostics)
+    errors = checker.errors or modernizer.errors
+    annotations = None
+    if options.annotations:
+        annotations = qualified_annotations(
+            path,
+            {
+                key: comment_type(comment) or ""
+                for key, comment in modernizer.annotations.items()
+            },
+        )
+    if not modernizer.modified:
+        return _Outcome(errors, annotations=annotations, diagnostics=diagnostics)
+    with profile.phase("codegen"):
+        modified_source = modified_tree.code
+    del modified_tree
+    if modified_source == py_source:
+        return _Outcome(errors, annotations=annotations, diagnostics=diagnostics)
+    if options.write:
+        return _Outcome(errors, True, modified_source, annotations, diagnostics)
+    diff = None
+    if not options.quiet:
+        with profile.phase("diff"):
+            if options.structured:
+                buffer = io.StringIO()
+                write_diff(buffer, py_source, modified_source, f"a{path}", f"b{path}")
+                diff = buffer.getvalue()
+            else:
+                write_diff(
+                    sys.stdout, py_source, modified_source, f"a{path}", f"b{path}"
+                )
+                # the trailing newline print() used to add after the joined diff
+                sys.stdout.write("\n")
+    return _Outcome(errors, True, None, annotations, diagnostics, diff)
+
+
+def write_diff(
+    stream: TextIO, source: str, modified: str, fromfile: str, tofile: str
+) -> None:
+    import difflib
+
+    lines = difflib.unified_diff(
+        source.splitlines(True), modified.splitlines(True), fromfile, tofile
+    )
+    stream.writelines(lines)
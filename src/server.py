@@ -0,0 +1,150 @@
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from src.cache import ResultCache
+from src.client import DaemonError
+from src.main import run_in_pool
+from src.runner import Options, process_file
+
+# Daemon keeping warm worker processes, with libcst imported and the rule
+# tables compiled, serving requests over a Unix socket (see src/client.py).
+
+WARM_UP_SOURCE = "import sys\nx = map(str, sys.argv)  # type: int\n"
+
+
+def _warm_up() -> None:
+    process_file(Path("(warm-up)"), Options(quiet=True), source=WARM_UP_SOURCE)
+
+
+def _remove_stale_socket(socket_path: Path) -> None:
+    # A socket left over by a daemon that did not shut down cleanly is
+    # removed; a live daemon's socket or any other file is left alone.
+    try:
+        mode = socket_path.lstat().st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise DaemonError(f"{socket_path}: exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            socket_path.unlink()
+            return
+    raise DaemonError(f"{socket_path}: another daemon is listening")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "Server"
+
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if not line.strip():
+            # a connection closed without a request, e.g. a liveness probe
+            return
+        try:
+            request = json.loads(line)
+            if request.get("command") == "shutdown":
+                self.send({"done": True})
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            self.server.process(request, self.send)
+            self.send({"done": True})
+        except ConnectionError:
+            # the client went away
+            pass
+        except Exception as e:
+            try:
+                self.send({"done": True, "error": f"{type(e).__name__}: {e}"})
+            except ConnectionError:
+                pass
+
+    def send(self, data: Dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(data).encode() + b"\n")
+        self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: Path,
+        jobs: Optional[int] = None,
+        cache_dir: Optional[Path] = None,
+        cache_size: int = 0,
+        module_cache_size: int = 0,
+    ):
+        _remove_stale_socket(socket_path)
+        super().__init__(str(socket_path), _Handler)
+        self.socket_path = socket_path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+        for future in [self.executor.submit(_warm_up) for _ in range(self.jobs)]:
+            future.result()
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.module_cache_size = module_cache_size
+        self.requests = 0
+
+    def process(self, request: Dict[str, Any], send: Any) -> None:
+        options = Options(**request.get("options", {}))
+        cache = None
+        if self.cache_dir:
+            cache = ResultCache(
+                self.cache_dir,
+                options.fingerprint(),
+                self.cache_size,
+                self.module_cache_size,
+            )
+        sources = {
+            Path(item["path"]): item["source"] for item in request.get("sources", [])
+        }
+        paths = [Path(path) for path in request.get("paths", [])] + list(sources)
+        changes = {
+            Path(path): ranges for path, ranges in request.get("lines", {}).items()
+        }
+        for result in run_in_pool(
+            self.executor,
+            paths,
+            options,
+            cache,
+            self.jobs * 4,
+            sources,
+            request.get("cwd"),
+            changes,
+        ):
+            data = result._asdict()
+            data["path"] = str(result.path)
+            send(data)
+        self.requests += 1
+        if cache and self.requests % 100 == 0:
+            cache.evict()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown()
+        try:
+            self.socket_path.unlink()
+        except OSError:
+            pass
+
+
+def serve(
+    socket_path: Path,
+    jobs: Optional[int] = None,
+    cache_dir: Optional[Path] = None,
+    cache_size: int = 0,
+    module_cache_size: int = 0,
+) -> None:
+    with Server(
+        socket_path, jobs, cache_dir, cache_size, module_cache_size
+    ) as server:
+        server.serve_forever()
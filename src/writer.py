@@ -0,0 +1,56 @@
+import os
+import queue
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+
+def atomic_write(path: Path, source: str, encoding: str) -> None:
+    # next to the real file, so that symbolic links to it stay links
+    path = path.resolve()
+    data = source.encode(encoding)
+    mode = path.stat().st_mode
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class Writer:
+    # Writes files from a background thread so that disk I/O overlaps with
+    # processing the next files. Errors are collected and re-raised by close().
+
+    def __init__(self, maxsize: int = 64):
+        self.queue: "queue.Queue[Optional[Tuple[Path, str, str]]]" = queue.Queue(
+            maxsize
+        )
+        self.errors: List[Tuple[Path, OSError]] = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, path: Path, source: str, encoding: str) -> None:
+        self.queue.put((path, source, encoding))
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        if self.errors:
+            path, error = self.errors[0]
+            raise error
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, source, encoding = item
+            try:
+                atomic_write(path, source, encoding)
+            except OSError as e:
+                self.errors.append((path, e))
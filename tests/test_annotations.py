@@ -0,0 +1,81 @@
+from pathlib import Path
+
+import libcst as cst
+
+from src.annotations import AnnotationIndex, module_name, write_index
+from src.modernizer import Modernizer, comment_type
+from src.runner import Options, process_file
+
+
+def test_modernizer_annotations_01():
+    source = """
+x = 1  # type: int
+class A:
+    def f(self, a,  # type: int
+          b=lambda q: q):
+        # type: (int, Callable) -> None
+        y, z = 1, 2  # type: Tuple[int, int]
+        w = v = []  # type: List[str]
+    def g(self): # type: () -> str
+        return ""
+"""
+    modernizer = Modernizer(Path("(test)"))
+    cst.MetadataWrapper(cst.parse_module(source)).visit(modernizer)
+    assert {k: comment_type(v) for k, v in modernizer.annotations.items()} == {
+        ("x",): "int",
+        ("A", "f"): "(int, Callable) -> None",
+        ("A", "f", "a"): "int",
+        ("A", "f", "w"): "List[str]",
+        ("A", "f", "v"): "List[str]",
+        ("A", "g"): "() -> str",
+    }
+
+
+def test_modernizer_annotations_02():
+    source = """
+import foo  # type: ignore
+x = foo.f()  # type: ignore[attr-defined]
+def f(a):  # type: ignore
+    y = a  # type: ignored
+"""
+    modernizer = Modernizer(Path("(test)"))
+    cst.MetadataWrapper(cst.parse_module(source)).visit(modernizer)
+    assert {k: comment_type(v) for k, v in modernizer.annotations.items()} == {
+        ("f", "y"): "ignored",
+    }
+
+
+def test_process_file_01(tmp_path):
+    path = tmp_path / "m.py"
+    path.write_text("x = []  # type: List[int]\n")
+    # only collected for the annotation index
+    assert process_file(path, Options(prefilter=False)).annotations is None
+    result = process_file(path, Options(prefilter=False, annotations=True))
+    assert list(result.annotations.values()) == ["List[int]"]
+
+
+def test_module_name_01(tmp_path, monkeypatch):
+    for name in ["pkg/__init__.py", "pkg/sub/__init__.py", "pkg/sub/mod.py"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("")
+    assert module_name(tmp_path / "pkg/sub/mod.py") == "pkg.sub.mod"
+    assert module_name(tmp_path / "pkg/__init__.py") == "pkg"
+    assert module_name(tmp_path / "script.py") == "script"
+    monkeypatch.chdir(tmp_path / "pkg")
+    assert module_name(Path("sub/mod.py")) == "pkg.sub.mod"
+
+
+def test_index_01(tmp_path):
+    annotations = {f"pkg.mod{i}.f.x": f"List[{i}]" for i in range(100)}
+    annotations["pkg.é"] = "Dict[str, ü]"
+    write_index(tmp_path / "index", annotations)
+    with AnnotationIndex(tmp_path / "index") as index:
+        assert len(index) == len(annotations)
+        assert dict(index.items()) == annotations
+        for key, value in annotations.items():
+            assert index.get(key) == value
+        assert index.get("pkg") is None
+        assert index.get("zzz") is None
+    write_index(tmp_path / "empty", {})
+    with AnnotationIndex(tmp_path / "empty") as index:
+        assert index.get("pkg") is None
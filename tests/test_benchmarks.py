@@ -0,0 +1,32 @@
+import argparse
+
+import libcst as cst
+
+from benchmarks.bench import PHASES, run
+from benchmarks.corpus import generate_corpus
+from benchmarks.startup import (
+    IMPORT_BUDGET,
+    heavy_imports,
+    import_time,
+)
+
+
+def test_corpus_01():
+    first = list(generate_corpus(3, statements=30, density=0.5, depth=3, seed=1))
+    assert first == list(generate_corpus(3, statements=30, density=0.5, depth=3, seed=1))
+    for source in first:
+        assert cst.parse_module(source).code == source
+
+
+def test_run_01():
+    args = argparse.Namespace(
+        files=1, statements=10, density=0.5, depth=1, seed=0, repeat=1
+    )
+    result = run(args)
+    assert set(result["phases"]) == set(PHASES)
+    assert result["lines"] > 0 and result["files_per_sec"] > 0
+
+
+def test_startup_01():
+    assert heavy_imports("src.main") == []
+    assert min(import_time("src.main") for _ in range(3)) < IMPORT_BUDGET
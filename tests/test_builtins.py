@@ -141,3 +141,177 @@ for i in range(4):
     print(i)
 """
     check_result(source, expected)
+
+
+def test_shadowed_01():
+    source = """
+def foo(map, xs):
+    range = xs.range
+    return map(len, xs), range(3), [zip(x) for zip in xs]
+"""
+    check_result(source, source)
+
+
+def test_consumers_01():
+    source = """
+def foo(d, xs):
+    total = sum(d.values()) + len(d.keys()) + len(range(3))
+    if 1 in d.keys() and any(map(bool, xs)):
+        a, b = zip(*d.items())
+        print(*map(str, xs), max(d.keys()), ", ".join(d.keys()))
+    return sorted(filter(None, xs)), len(map(str, xs)), max(d.keys(), 1)
+
+
+def bar(d):
+    return reversed(d.keys())
+"""
+    expected = """
+from builtins import filter, map, range, zip  # noqa
+
+
+def foo(d, xs):
+    total = sum(d.values()) + len(d.keys()) + len(range(3))
+    if 1 in d.keys() and any(map(bool, xs)):
+        a, b = zip(*d.items())
+        print(*map(str, xs), max(d.keys()), ", ".join(d.keys()))
+    return sorted(filter(None, xs)), len(list(map(str, xs))), max(list(d.keys()), 1)
+
+
+def bar(d):
+    return reversed(list(d.keys()))
+"""
+    check_result(source, expected)
+
+
+def test_consumers_02():
+    # only the loops of a variable that is not used otherwise, and whose value
+    # the loop does not change, can be given the iterator
+    source = """
+def foo(d, xs):
+    keys = d.keys()
+    for k in keys:
+        print(k)
+    items = d.items()
+    for k, v in items:
+        del d[k]
+    ys = map(str, xs)
+    for y in ys:
+        print(y)
+    print(ys)
+    for x in xs:
+        zs = zip(x, xs)
+    return zs
+"""
+    expected = """
+from builtins import map, zip  # noqa
+
+
+def foo(d, xs):
+    keys = d.keys()
+    for k in keys:
+        print(k)
+    items = list(d.items())
+    for k, v in items:
+        del d[k]
+    ys = list(map(str, xs))
+    for y in ys:
+        print(y)
+    print(ys)
+    for x in xs:
+        zs = list(zip(x, xs))
+    return zs
+"""
+    check_result(source, expected)
+
+
+
+def test_consumers_03():
+    # the iterator would see what happens between the assignment and the
+    # loop, and would call log() while the loop runs
+    source = """
+def foo(d, items, log):
+    ks = d.keys()
+    d.clear()
+    for k in ks:
+        print(k)
+    vs = d.values()
+    d["new"] = 1
+    for v in vs:
+        print(k)
+    xs = map(log, items)
+    print("start")
+    for x in xs:
+        print(x)
+    ys = map(log, items)
+    for y in ys:
+        print(y)
+    zs = map(str, items)
+    for z in zs:
+        print(z)
+    for k in d.keys():
+        del d[k]
+    for v in d.values():
+        print(v)
+"""
+    expected = """
+from builtins import map  # noqa
+
+
+def foo(d, items, log):
+    ks = list(d.keys())
+    d.clear()
+    for k in ks:
+        print(k)
+    vs = list(d.values())
+    d["new"] = 1
+    for v in vs:
+        print(k)
+    xs = list(map(log, items))
+    print("start")
+    for x in xs:
+        print(x)
+    ys = list(map(log, items))
+    for y in ys:
+        print(y)
+    zs = map(str, items)
+    for z in zs:
+        print(z)
+    for k in list(d.keys()):
+        del d[k]
+    for v in d.values():
+        print(v)
+"""
+    check_result(source, expected)
+
+def test_import_position_01():
+    # after the statement holding the last import, else after the docstring
+    source = '''"""Doc."""
+import os
+try:
+    import json
+except ImportError:
+    json = None
+x = map(f, y)
+'''
+    expected = '''"""Doc."""
+import os
+try:
+    import json
+except ImportError:
+    json = None
+from builtins import map  # noqa
+x = list(map(f, y))
+'''
+    check_result(source, expected)
+    source = '''"""Doc."""
+
+x = map(f, y)
+'''
+    expected = '''"""Doc."""
+
+from builtins import map  # noqa
+
+
+x = list(map(f, y))
+'''
+    check_result(source, expected)
@@ -0,0 +1,78 @@
+import subprocess
+from pathlib import Path
+
+from src.changes import changed_files, overlaps, parse_diff
+from src.runner import Options, process_file
+
+DIFF = """\
+diff --git pkg/a.py pkg/a.py
+--- pkg/a.py
++++ pkg/a.py
+@@ -3 +3,2 @@ def f():
+-    x = 1
++    x = 2
++    y = 3
+@@ -10,2 +11,0 @@ def g():
+-    pass
+-    pass
+diff --git b.py b.py
+new file mode 100644
+--- /dev/null
++++ b.py
+@@ -0,0 +1 @@
++print(1)
+"""
+
+
+def test_parse_diff_01():
+    assert parse_diff(DIFF) == {
+        Path("pkg/a.py"): [(3, 4), (11, 12)],
+        Path("b.py"): [(1, 1)],
+    }
+    assert overlaps([(3, 4)], 4, 8) and not overlaps([(3, 4)], 5, 8)
+    assert overlaps(None, 1, 1)
+
+
+def test_parse_diff_02():
+    diff = (
+        '+++ "\\303\\251.py"\n@@ -1 +1 @@\n'
+        "+++ a b.py\t\n@@ -1 +1 @@\n"
+        '+++ "q\\"t.py"\n@@ -1 +1 @@\n'
+    )
+    assert parse_diff(diff) == {
+        Path("\u00e9.py"): [(1, 1)],
+        Path("a b.py"): [(1, 1)],
+        Path('q"t.py'): [(1, 1)],
+    }
+
+
+def test_changed_files_01(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def git(*args):
+        subprocess.run(["git", *args], check=True, stdout=subprocess.DEVNULL)
+
+    git("init", "-q")
+    git("config", "user.email", "test@example.com")
+    git("config", "user.name", "test")
+    path = Path("m.py")
+    path.write_text("x = 1 / 2\ny = xrange(2)\nz = 3\n")
+    Path("same.py").write_text("print(1)\n")
+    git("add", ".")
+    git("commit", "-q", "-m", "initial")
+    # whatever git's default branch name is
+    git("branch", "base")
+    git("checkout", "-q", "-b", "feature")
+    path.write_text("x = 1 / 2\ny = xrange(2)\nz = 3\nw = 4\n")
+    git("commit", "-q", "-a", "-m", "feature")
+    # uncommitted
+    path.write_text("x = 1 / 2\ny = xrange(2)\nz = unicode(3) / 4\nw = 4\n")
+    Path("new.py").write_text("print(xrange(3))\n")
+    changes = changed_files("base")
+    assert changes == {Path("m.py"): [(3, 4)], Path("new.py"): None}
+
+    result = process_file(path, Options(), lines=changes[path])
+    assert result.output.count(": division") == 1
+    assert ":3:4: division" in result.output
+    assert "+z = text_type(3) / 4" in result.output
+    assert " y = xrange(2)\n" in result.output
@@ -2,6 +2,7 @@ from pathlib import Path
 
 import libcst as cst
 
+import src.positions
 from src.checker import Checker
 
 
@@ -28,3 +29,53 @@ def test_1():
     checker = Checker(Path("(test)"))
     wrapper.visit(checker)
     assert not checker.errors
+
+
+def test_lazy_positions_01(monkeypatch, fast=True):
+    monkeypatch.setattr(src.positions, "FAST", fast)
+    source = """
+import sys
+x = 1 / 2
+class MyTestCase(unittest.TestCase):
+    def test_1(self):
+        self.assertEquals(sys.maxint, x)
+y = 3
+"""
+    module = cst.parse_module(source)
+    eager = Checker(Path("(test)"))
+    cst.MetadataWrapper(module).visit(eager)
+    checker = Checker(Path("(test)"), lazy_positions=True)
+    module.visit(checker)
+    assert checker.pending and not checker.diagnostics
+    checker.flush(module)
+    assert checker.errors and checker.diagnostics == eager.diagnostics
+    assert [(d.line, d.column, d.rule) for d in eager.diagnostics] == [
+        (3, 4, "division"),
+        (6, 8, "assertEquals"),
+        (6, 26, "sys.maxint"),
+    ]
+
+
+def test_lazy_positions_02(monkeypatch):
+    # without the libcst internals
+    test_lazy_positions_01(monkeypatch, fast=False)
+
+
+def test_select_01():
+    source = """
+import sys
+x = 1 / 2
+self.assertEquals(sys.maxint, x)
+"""
+    module = cst.parse_module(source)
+    checker = Checker(Path("(test)"), selected=["sys.maxint", "division"])
+    assert "check_div" in checker.handler_names()
+    assert "check_assert_equals" not in checker.handler_names()
+    cst.MetadataWrapper(module).visit(checker)
+    assert [d.rule for d in checker.diagnostics] == ["division", "sys.maxint"]
+    checker = Checker(
+        Path("(test)"), ignored=["division"], selected=["sys.maxint", "division"]
+    )
+    assert "check_div" not in checker.handler_names()
+    cst.MetadataWrapper(module).visit(checker)
+    assert [d.rule for d in checker.diagnostics] == ["sys.maxint"]
@@ -0,0 +1,41 @@
+import io
+import json
+
+from src.diagnostics import Diagnostic, JsonLinesEmitter, SarifEmitter
+from src.runner import Options, process_file
+
+
+def test_structured_01(tmp_path, capsys):
+    path = tmp_path / "m.py"
+    path.write_text("x = 1 / 2\nprint(xrange(3))\n")
+    text = process_file(path, Options())
+    result = process_file(path, Options(structured=True))
+    assert result.output == ""
+    assert result.diagnostics == [
+        Diagnostic(str(path), 1, 4, "division", text.diagnostics[0].message)
+    ]
+    # the text output ends with a blank line, the diff itself does not
+    assert result.diff.endswith("print(range(3))\n")
+    assert text.output == f"{result.diagnostics[0]}\n{result.diff}\n"
+
+
+def test_emitters_01():
+    diagnostics = [("a.py", 3, 0, "sys.maxint", "use of sys.maxint")]
+    stream = io.StringIO()
+    emitter = JsonLinesEmitter(stream)
+    emitter.emit("a.py", diagnostics, True, "diff")
+    emitter.emit("b.py", [])
+    emitter.close()
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [r["rule"] for r in records] == ["sys.maxint", "rewrite"]
+    assert records[0]["line"] == 3 and records[1]["diff"] == "diff"
+
+    stream = io.StringIO()
+    emitter = SarifEmitter(stream)
+    emitter.emit("a.py", diagnostics)
+    emitter.emit("b.py", [], True)
+    emitter.close()
+    (run,) = json.loads(stream.getvalue())["runs"]
+    assert [r["ruleId"] for r in run["results"]] == ["sys.maxint", "rewrite"]
+    region = run["results"][0]["locations"][0]["physicalLocation"]["region"]
+    assert region == {"startLine": 3, "startColumn": 1}
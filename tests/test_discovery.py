@@ -0,0 +1,74 @@
+from src.discovery import discover, walk
+
+
+def make_tree(root, files):
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def test_walk_01(tmp_path):
+    make_tree(
+        tmp_path,
+        {
+            "b.py": "",
+            "a.py": "",
+            "notes.txt": "",
+            "pkg/z.py": "",
+            "pkg/sub/y.py": "",
+            "aa/x.py": "",
+            "venv/lib/site.py": "",
+            "pkg/__pycache__/z.py": "",
+        },
+    )
+    assert [p.relative_to(tmp_path).as_posix() for p in walk(tmp_path)] == [
+        "a.py",
+        "b.py",
+        "aa/x.py",
+        "pkg/z.py",
+        "pkg/sub/y.py",
+    ]
+
+
+def test_gitignore_01(tmp_path):
+    make_tree(
+        tmp_path,
+        {
+            ".gitignore": "# comment\nbuild/\n/top.py\n*_pb2.py\n!keep_pb2.py\n",
+            "top.py": "",
+            "a.py": "",
+            "build/gen.py": "",
+            "gen_pb2.py": "",
+            "keep_pb2.py": "",
+            "pkg/top.py": "",
+            "pkg/.gitignore": "local.py\ndeep/**/*.py\n",
+            "pkg/local.py": "",
+            "pkg/deep/a/b.py": "",
+            "other/local.py": "",
+        },
+    )
+    (tmp_path / ".git").mkdir()
+    found = [p.relative_to(tmp_path).as_posix() for p in walk(tmp_path)]
+    assert found == ["a.py", "keep_pb2.py", "other/local.py", "pkg/top.py"]
+    found = [p.relative_to(tmp_path).as_posix() for p in walk(tmp_path / "pkg")]
+    assert found == ["pkg/top.py"]
+    assert len(list(walk(tmp_path, gitignore=False))) == 9
+
+
+def test_discover_01(tmp_path):
+    make_tree(tmp_path, {"a.py": "", "b.txt": "", "d/c.py": "", "d/e.py": ""})
+    paths = [tmp_path / "b.txt", tmp_path / "a.py", tmp_path / "d" / "*.py"]
+    found = discover(paths, exclude=["e.py"])
+    assert next(found) == tmp_path / "a.py"
+    assert list(found) == [tmp_path / "d" / "c.py", tmp_path / "d" / "e.py"]
+
+
+def test_walk_02(tmp_path):
+    make_tree(tmp_path, {"a.py": "", "pkg/b.py": ""})
+    (tmp_path / "pkg" / "up").symlink_to("..", target_is_directory=True)
+    (tmp_path / "pkg" / "dangling.py").symlink_to("missing.py")
+    assert [p.relative_to(tmp_path).as_posix() for p in walk(tmp_path)] == [
+        "a.py",
+        "pkg/b.py",
+    ]
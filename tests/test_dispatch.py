@@ -0,0 +1,129 @@
+import libcst as cst
+from libcst import matchers as m
+
+from src.dispatch import CompiledTransformer, CompiledVisitor, matcher_keys
+
+SOURCE = """
+import os
+from builtins import map as m2, str
+def f(d):
+    x = map(str, d.keys())
+    for k in d.keys():
+        print(list(map(len, k)), os.path.join(k, "x"), [zip(a) for a in k])
+    class A:
+        def g(self):
+            return xrange(3)
+"""
+
+
+class _Handlers:
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    @m.call_if_inside(m.ImportFrom(module=m.Name("builtins")))
+    @m.visit(m.ImportAlias() | m.ImportStar())
+    def visit_import(self, node):
+        self.calls.append(("import", cst.Module([]).code_for_node(node)))
+
+    @m.call_if_not_inside(m.Call(func=m.Name("list")) | m.For() | m.CompFor())
+    @m.visit(m.Call(func=m.Name("map") | m.Name("zip")))
+    def visit_map(self, node):
+        self.calls.append(("map", cst.Module([]).code_for_node(node)))
+
+    @m.visit(m.Call(func=m.Attribute(attr=m.Name("keys"))))
+    def visit_keys(self, node):
+        self.calls.append(("keys", cst.Module([]).code_for_node(node)))
+
+    @m.call_if_inside(m.ClassDef())
+    @m.call_if_inside(m.FunctionDef(name=m.Name("g")))
+    @m.visit(m.Name("xrange"))
+    def visit_xrange(self, node):
+        self.calls.append(("xrange", node.value))
+
+    @m.call_if_not_inside(m.ClassDef())
+    def visit_FunctionDef(self, node):
+        self.calls.append(("def", node.name.value))
+
+    def visit_FunctionDef_params(self, node):
+        self.calls.append(("params", node.name.value))
+
+
+class _VisitorHandlers(_Handlers):
+    @m.leave(m.Name("os"))
+    def leave_os(self, original_node) -> None:
+        self.calls.append(("os", original_node.value))
+
+
+class _TransformerHandlers(_Handlers):
+    @m.leave(m.Name("os"))
+    def leave_os(self, original_node, updated_node) -> cst.Name:
+        self.calls.append(("os", original_node.value))
+        return updated_node
+
+
+class Compiled(_VisitorHandlers, CompiledVisitor):
+    pass
+
+
+class Reference(_VisitorHandlers, m.MatcherDecoratableVisitor):
+    pass
+
+
+class CompiledT(_TransformerHandlers, CompiledTransformer):
+    pass
+
+
+class ReferenceT(_TransformerHandlers, m.MatcherDecoratableTransformer):
+    pass
+
+
+def test_same_as_libcst_01():
+    module = cst.parse_module(SOURCE)
+    for compiled, reference in ((Compiled(), Reference()), (CompiledT(), ReferenceT())):
+        module.visit(compiled)
+        module.visit(reference)
+        assert compiled.calls == reference.calls
+    assert ("xrange", "xrange") in compiled.calls
+    assert ("map", "map(str, d.keys())") in compiled.calls
+    assert ("map", "map(len, k)") not in compiled.calls
+
+
+def test_matcher_keys_01():
+    assert matcher_keys(m.Call(func=m.Name("a") | m.Attribute(attr=m.Name("b")))) == {
+        "a",
+        "b",
+    }
+    assert matcher_keys(m.Call()) is None
+    assert matcher_keys(m.Name("a") | m.Call(func=m.Name("b"))) == {"a", "b"}
+    assert matcher_keys(m.Name("a") | m.ImportAlias()) is None
+
+
+def test_shared_matcher_01():
+    # a matcher shared by a visit and a leave handler is evaluated once per node
+    evaluated = []
+
+    def is_map(func):
+        evaluated.append(func)
+        return m.matches(func, m.Name("map"))
+
+    matcher = m.Call(func=m.MatchIfTrue(is_map))
+
+    class Shared(CompiledTransformer):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        @m.visit(matcher)
+        def visit_map(self, node):
+            self.calls.append("visit")
+
+        @m.leave(matcher)
+        def leave_map(self, original_node, updated_node):
+            self.calls.append("leave")
+            return updated_node
+
+    visitor = Shared()
+    cst.parse_module(SOURCE).visit(visitor)
+    assert visitor.calls == ["visit", "leave", "visit", "leave"]
+    assert len(evaluated) == len(m.findall(cst.parse_module(SOURCE), m.Call()))
@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import libcst as cst
+
+from src.checker import Checker
+from src.engine import Engine
+from src.modernizer import Modernizer
+
+SOURCE = """
+import sys
+
+
+class A:
+    def f(self, i):  # type: (int) -> None
+        x = sys.maxint  # type: int
+        self.assertEquals(1, 2)
+        return i / 2 + unicode(d.keys()) + [xrange(i) for i in d.itervalues()]
+"""
+
+
+def test_single_pass_01(capsys):
+    wrapper = cst.MetadataWrapper(cst.parse_module(SOURCE))
+    checker = Checker(Path("(test)"), verbose=True)
+    wrapper.visit(checker)
+    modernizer = Modernizer(Path("(test)"), verbose=True)
+    expected_tree = wrapper.visit(modernizer)
+    expected_output = capsys.readouterr().out
+
+    wrapper = cst.MetadataWrapper(cst.parse_module(SOURCE))
+    checker = Checker(Path("(test)"), verbose=True)
+    modernizer = Modernizer(Path("(test)"), verbose=True)
+    engine = Engine([checker], modernizer)
+    modified_tree = wrapper.visit(engine)
+    engine.flush()
+    assert checker.errors
+    assert modified_tree.code == expected_tree.code
+    assert capsys.readouterr().out == expected_output
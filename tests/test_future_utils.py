@@ -76,3 +76,84 @@ def foo(d):
         print("={}".format(v))
 """
     check_result(source, expected)
+
+
+def test_05():
+    source = """
+# py2 compatibility
+from builtins import str
+from future.utils import PY2
+x = map(f, unicode(y))
+"""
+    expected = """
+# py2 compatibility
+from builtins import map, str  # noqa
+from future.utils import PY2, text_type
+x = list(map(f, text_type(y)))
+"""
+    check_result(source, expected)
+
+
+def test_06():
+    source = """
+import os
+x = map(f, os.environ.iterkeys())
+"""
+    expected = """
+import os
+from builtins import map  # noqa
+from future.utils import iterkeys
+x = list(map(f, iterkeys(os.environ)))
+"""
+    check_result(source, expected)
+
+
+def test_07():
+    source = """
+class A(object):
+    unicode = None
+
+    def f(self, unicode=None):
+        return self.unicode or unicode or g(unicode=1)
+
+    def g(self, s):
+        return unicode(s)
+"""
+    expected = """
+from future.utils import text_type
+
+
+class A(object):
+    unicode = None
+
+    def f(self, unicode=None):
+        return self.unicode or unicode or g(unicode=1)
+
+    def g(self, s):
+        return text_type(s)
+"""
+    check_result(source, expected)
+
+
+def test_08():
+    source = """
+try:
+    unicode
+except NameError:
+    unicode = str
+x = unicode(y)
+"""
+    check_result(source, source)
+
+
+def test_09():
+    source = """
+print(x.unicode, unicode(y))
+"""
+    expected = """
+from future.utils import text_type
+
+
+print(x.unicode, text_type(y))
+"""
+    check_result(source, expected)
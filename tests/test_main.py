@@ -0,0 +1,163 @@
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+import libcst as cst
+
+import src.cache
+from src.cache import ResultCache
+from src.main import run_in_pool, run_parallel, run_serial
+from src.runner import Options, process_file
+from src.writer import Writer
+
+
+def test_parallel_order_01(tmp_path, capsys):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"m{i}.py"
+        path.write_text(f"x = xrange({i})\n" if i % 2 else "x = 1\n")
+        paths.append(path)
+    options = Options()
+    serial = list(run_serial(paths, options))
+    parallel = list(run_parallel(paths, options, jobs=2))
+    assert [r.path for r in parallel] == paths
+    assert [r.errors for r in parallel] == [r.errors for r in serial]
+    assert "".join(r.output for r in parallel) == capsys.readouterr().out
+
+
+def test_parallel_exitfirst_01(tmp_path):
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"m{i}.py"
+        path.write_text("x = 1 / 2\n" if i == 1 else f"x = range({i})\n")
+        paths.append(path)
+    options = Options(exitfirst=True)
+    cache = ResultCache(tmp_path / "cache", options.fingerprint())
+    # all files queued at once, on a single worker
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        for result in run_in_pool(executor, paths, options, cache, window=20):
+            if result.errors:
+                break
+    assert result.errors
+    assert result.path == paths[1]
+    # the files still queued after the failure were cancelled: besides those
+    # the worker had already taken, none of them left a cache entry
+    for path in paths[5:]:
+        assert cache.get(cache.key(path, path.read_text())) is None
+
+
+def test_cache_01(tmp_path, monkeypatch):
+    path = tmp_path / "m.py"
+    path.write_text("x = 1 / 2\nprint(xrange(3))\n")
+    options = Options()
+    cache = ResultCache(tmp_path / "cache", options.fingerprint())
+    cold = process_file(path, options, cache)
+    key = cache.key(path, path.read_text())
+    assert cache.get(key)["output"] == cold.output
+    warm = process_file(path, options, cache)
+    assert warm.status == "cached"
+    assert warm[:3] == cold[:3]
+    other = ResultCache(tmp_path / "cache", Options(ignored=["division"]).fingerprint())
+    assert other.get(other.key(path, path.read_text())) is None
+    # nor results computed with another libcst or interpreter
+    monkeypatch.setattr(src.cache, "runtime_fingerprint", lambda: "libcst 0.1")
+    other = ResultCache(tmp_path / "cache", options.fingerprint())
+    assert other.get(other.key(path, path.read_text())) is None
+
+
+def test_module_cache_01(tmp_path, monkeypatch):
+    path = tmp_path / "m.py"
+    source = "x = 1 / 2\nprint(xrange(3), d.iterkeys())\n"
+    path.write_text(source)
+    assert ResultCache(tmp_path / "cache").modules is None
+    cache = ResultCache(tmp_path / "cache", Options().fingerprint(), 2**20, 2**20)
+    process_file(path, Options(), cache)
+    module = cache.modules.get(cache.modules.key(source))
+    assert module is not None and module.deep_equals(cst.parse_module(source))
+    options = Options(ignored=["division"])
+    expected = process_file(path, options)
+    # a run with other options reuses the parsed module
+    other = ResultCache(tmp_path / "cache", options.fingerprint(), 2**20, 2**20)
+    monkeypatch.setattr(cst, "parse_module", None)
+    result = process_file(path, options, other)
+    assert result.status == "parsed"
+    assert result[:3] == expected[:3]
+    # entries that fail to load in any way are misses
+    key = cache.modules.key(source)
+    (tmp_path / "cache" / "modules" / key[:2] / key[2:]).write_bytes(
+        b"\x80\x04cno_such_module\nNode\n."
+    )
+    assert cache.modules.get(key) is None
+
+
+def test_stream_01(tmp_path):
+    path = tmp_path / "m.py"
+    path.write_text("print(xrange(3))\n")
+    stream = io.StringIO()
+    streamed = process_file(path, Options(), stream=stream)
+    captured = process_file(path, Options())
+    assert streamed.output == ""
+    assert stream.getvalue() == captured.output
+    path.write_text("print(1)\n")
+    assert process_file(path, Options(prefilter=False)).output == ""
+
+
+def test_cache_evict_01(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_size=100)
+    for i in range(10):
+        cache.put(cache.key(tmp_path / f"m{i}.py", ""), output="x" * 20)
+    cache.evict()
+    total = sum(p.stat().st_size for p in (tmp_path / "cache").glob("*/*"))
+    assert 0 < total <= 100
+
+
+def test_write_01(tmp_path):
+    path = tmp_path / "m.py"
+    path.write_bytes(b"# -*- coding: latin-1 -*-\r\ns = '\xe9'\r\nx = unicode(s)\r\n")
+    path.chmod(0o755)
+    result = process_file(path, Options(write=True))
+    assert result.changed and result.output == ""
+    assert result.encoding == "iso-8859-1"
+    writer = Writer()
+    writer.write(path, result.new_source, result.encoding)
+    writer.close()
+    assert path.read_bytes() == (
+        b"# -*- coding: latin-1 -*-\r\nfrom future.utils import text_type\r\n\r\n\r\n"
+        b"s = '\xe9'\r\nx = text_type(s)\r\n"
+    )
+    assert path.stat().st_mode & 0o777 == 0o755
+    assert [p.name for p in tmp_path.iterdir()] == ["m.py"]
+    assert not process_file(path, Options(write=True)).changed
+
+
+def test_write_02(tmp_path):
+    (tmp_path / "real").mkdir()
+    target = tmp_path / "real" / "m.py"
+    target.write_text("x = unicode(1)\n")
+    link = tmp_path / "m.py"
+    link.symlink_to(target)
+    result = process_file(link, Options(write=True))
+    writer = Writer()
+    writer.write(link, result.new_source, result.encoding)
+    writer.close()
+    assert link.is_symlink()
+    assert "text_type(1)" in target.read_text()
+
+
+def test_oversized_01(tmp_path):
+    path = tmp_path / "m.py"
+    path.write_text("x = 1 / 2\nprint(xrange(3))\n")
+    checked = process_file(path, Options(max_size=10))
+    assert checked.status == "parsed" and checked.errors and not checked.changed
+    assert "division" in checked.output and "+++" not in checked.output
+    warned = process_file(path, Options(max_size=10, oversized="warn"))
+    assert warned.status == "oversized" and not warned.errors
+    assert warned.output.startswith(f"{path}: skipped")
+    skipped = process_file(path, Options(max_size=10, oversized="skip"))
+    assert skipped.status == "oversized" and skipped.output == ""
+    assert process_file(path, Options(max_size=100)).changed
+    # the limit is on bytes: 35 characters, 49 bytes
+    path.write_text("print(xrange(3))  # éééééééééééééé\n", encoding="utf-8")
+    options = Options(max_size=40, oversized="warn")
+    assert process_file(path, options).output == (
+        f"{path}: skipped, 49 bytes (more than 40)\n"
+    )
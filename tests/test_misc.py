@@ -1,3 +1,8 @@
+from pathlib import Path
+
+import libcst as cst
+
+from src.modernizer import Modernizer
 from tests.check import check_result
 
 
@@ -50,3 +55,29 @@ def foo(i):
 """
     expected = source
     check_result(source, expected)
+
+
+def test_type_comments_01(capsys):
+    source = """
+f = lambda x, y=lambda z: z: x  # type: Callable
+def g(a,  # type: int
+      b):
+    a.b, (c, d[e]) = 1, 2  # type: Tuple[int, int]
+    pass
+"""
+    module = cst.parse_module(source)
+    wrapper = cst.MetadataWrapper(module)
+    wrapper.visit(Modernizer(Path("(test)"), verbose=True))
+    assert capsys.readouterr().out.splitlines() == [
+        "(test):2:0: variable f: Callable",
+        "(test):2:11: parameter x: unknown type",
+        "(test):2:14: parameter y: unknown type",
+        "(test):2:23: parameter z: unknown type",
+        "(test):3:6: parameter a: int",
+        "(test):4:6: parameter b: unknown type",
+        "(test):5:4: variable a: Tuple[int,",
+        "(test):5:4: variable b: Tuple[int,",
+        "(test):5:4: variable c: Tuple[int,",
+        "(test):5:4: variable d: Tuple[int,",
+        "(test):5:4: variable e: Tuple[int,",
+    ]
@@ -0,0 +1,41 @@
+import io
+
+import pytest
+
+from src.pipeline import OutputStream, prefetch
+
+
+def test_prefetch_01(tmp_path):
+    paths = []
+    for i in range(10):
+        path = tmp_path / f"m{i}.py"
+        path.write_text(f"x = {i}\n")
+        paths.append(path)
+    paths.insert(3, tmp_path / "missing.py")
+    results = []
+    for path, read in prefetch(paths, depth=4):
+        if path.name == "missing.py":
+            with pytest.raises(FileNotFoundError):
+                read.result()
+        else:
+            results.append((path, read.result()))
+    assert [path for path, _ in results] == [p for p in paths if p.exists()]
+    assert results[-1][1] == ("x = 9\n", "utf-8")
+
+
+class _Broken(io.StringIO):
+    def write(self, s):
+        raise BrokenPipeError()
+
+
+def test_output_stream_01():
+    stream = io.StringIO()
+    output = OutputStream(stream, maxsize=2)
+    for i in range(100):
+        output.write(f"{i}\n")
+    output.close()
+    assert stream.getvalue() == "".join(f"{i}\n" for i in range(100))
+    output = OutputStream(_Broken())
+    output.write("x")
+    with pytest.raises(BrokenPipeError):
+        output.close()
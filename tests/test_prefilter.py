@@ -0,0 +1,84 @@
+import dataclasses
+from pathlib import Path
+
+import libcst as cst
+import libcst.matchers as m
+from libcst.matchers._visitors import (
+    CONSTRUCTED_LEAVE_MATCHER_ATTR,
+    CONSTRUCTED_VISIT_MATCHER_ATTR,
+)
+
+from src.checker import Checker
+from src.modernizer import (
+    ITERATING_BUILTINS,
+    ITERATING_METHODS,
+    SIZED_BUILTINS,
+    Modernizer,
+)
+from src.prefilter import TRIGGER_NAMES, may_match
+from src.runner import Options, process_file
+
+# matched names that only record state and never trigger output on their own
+STATE_ONLY_NAMES = {
+    "division",
+    "sys",
+    # the consumers of iterators, see Modernizer.visit_iterating_call
+    *ITERATING_BUILTINS,
+    *ITERATING_METHODS,
+    *SIZED_BUILTINS,
+}
+
+
+def matcher_names(matcher):
+    if isinstance(matcher, m.Name):
+        if isinstance(matcher.value, str):
+            yield matcher.value
+    elif isinstance(matcher, (m.OneOf, m.AllOf)):
+        for option in matcher.options:
+            yield from matcher_names(option)
+    elif dataclasses.is_dataclass(matcher):
+        for field in dataclasses.fields(matcher):
+            yield from matcher_names(getattr(matcher, field.name))
+
+
+def test_trigger_names_01():
+    names = set()
+    for cls in (Checker, Modernizer):
+        for attr in vars(cls).values():
+            for matchers in (
+                getattr(attr, CONSTRUCTED_VISIT_MATCHER_ATTR, []),
+                getattr(attr, CONSTRUCTED_LEAVE_MATCHER_ATTR, []),
+            ):
+                for matcher in matchers:
+                    names.update(matcher_names(matcher))
+    assert names - STATE_ONLY_NAMES <= TRIGGER_NAMES
+
+
+CORPUS = [
+    "x = 1\n",
+    "x = 1 // 2\n",
+    "x /= 2\n",
+    "# map(x) / 2\n",
+    "s = 'a/b map unicode'\n",
+    "import sys\nprint(sys.maxsize)\n",
+    "class A:\n    def f(self, i):  # type: (int) -> None\n        return i\n",
+    "from builtins import str as text\n",
+    "x = f'{y}'\n",
+    "x = f'{map(y)}'\n",
+    "x = 1 / 2\n",
+    "d.keys()\n",
+]
+
+
+def test_corpus_01(tmp_path):
+    root = Path(__file__).parent.parent
+    sources = CORPUS + [p.read_text() for p in sorted(root.glob("tests/*.py"))]
+    for i, source in enumerate(sources):
+        path = tmp_path / f"m{i}.py"
+        path.write_text(source)
+        full = process_file(path, Options(prefilter=False))
+        filtered = process_file(path, Options())
+        assert filtered[:3] == full[:3], source
+        assert filtered.status == ("parsed" if may_match(source) else "skipped")
+        if not may_match(source):
+            assert cst.parse_module(source).code == source
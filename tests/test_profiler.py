@@ -0,0 +1,26 @@
+import io
+import json
+
+from src.profiler import Profile
+from src.runner import Options, process_file
+
+
+def test_profile_01(tmp_path):
+    path = tmp_path / "m.py"
+    path.write_text("x = 1 / 2\nprint(xrange(3))\n")
+    result = process_file(path, Options(profile=True, prefilter=False))
+    phases = [phase[0] for phase in result.profile["phases"]]
+    assert phases == ["read", "parse", "metadata", "visit", "codegen", "diff"]
+    assert result.profile["handlers"]["Checker.check_div"][0] == 1
+    assert result.profile["handlers"]["Modernizer.fix_xrange"][0] == 1
+    assert process_file(path, Options()).profile is None
+
+    profile = Profile()
+    profile.add(result.profile)
+    stream = io.StringIO()
+    profile.report(stream)
+    assert "Modernizer.fix_xrange" in stream.getvalue()
+    profile.write(tmp_path / "profile.json")
+    data = json.loads((tmp_path / "profile.json").read_text())
+    assert len(data["traceEvents"]) == len(phases)
+    assert data["summary"]["slowest"][0]["path"] == str(path)
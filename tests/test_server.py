@@ -0,0 +1,63 @@
+import socket
+import threading
+
+import pytest
+
+from src import client
+from src.main import run_remote, run_serial
+from src.runner import Options
+from src.server import Server
+
+
+def test_server_01(tmp_path, capsys):
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"m{i}.py"
+        path.write_text(f"x = xrange({i})\n" if i % 2 else "x = 1 / 2\n")
+        paths.append(path)
+    socket_path = tmp_path / "daemon.sock"
+    server = Server(socket_path, jobs=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        options = Options()
+        remote = list(run_remote(socket_path, paths, options))
+        capsys.readouterr()
+        serial = list(run_serial(paths, options))
+        assert [r.path for r in remote] == paths
+        assert [r.errors for r in remote] == [r.errors for r in serial]
+        assert "".join(r.output for r in remote) == capsys.readouterr().out
+
+        sources = {tmp_path / "buffer.py": "x = xrange(3)\n"}
+        (result,) = client.check(socket_path, sources=sources)
+        assert "range(3)" in result["output"]
+
+        # a connection without a request gets no reply
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            probe.connect(str(socket_path))
+            probe.shutdown(socket.SHUT_WR)
+            assert probe.recv(1024) == b""
+    finally:
+        client.shutdown(socket_path)
+        thread.join()
+        server.server_close()
+    assert not socket_path.exists()
+
+
+def test_socket_path_01(tmp_path):
+    path = tmp_path / "daemon.sock"
+    path.write_text("not a socket")
+    with pytest.raises(client.DaemonError, match="not a socket"):
+        Server(path)
+    assert path.read_text() == "not a socket"
+    path.unlink()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as live:
+        live.bind(str(path))
+        live.listen()
+        with pytest.raises(client.DaemonError, match="listening"):
+            Server(path)
+        assert path.exists()
+    # closed without removing its path, like a killed daemon: replaced
+    server = Server(path, jobs=1)
+    server.server_close()
+    assert not path.exists()